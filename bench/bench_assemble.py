@@ -0,0 +1,102 @@
+"""
+Benchmark casting a reduced (reservoir, time, step) dataset to the long-form dataframe pushed to BigQuery,
+comparing the original to_dataframe/groupby-apply path with `reduced_to_df`.
+
+    python bench/bench_assemble.py --reservoirs 20 --days 1461 --steps 90
+"""
+
+import argparse
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from h2ox.reducer.reducer import reduced_to_df
+
+
+def make_reduced(n_reservoirs, n_days, n_steps):
+
+    rng = np.random.default_rng(0)
+    coords = dict(
+        reservoir=[f"reservoir_{ii}" for ii in range(n_reservoirs)],
+        time=pd.date_range("2010-01-01", periods=n_days, freq="1D"),
+    )
+    dims = ("reservoir", "time")
+    shape = (n_reservoirs, n_days)
+
+    if n_steps > 0:
+        coords["step"] = pd.to_timedelta(np.arange(n_steps), unit="D")
+        dims = dims + ("step",)
+        shape = shape + (n_steps,)
+
+    return xr.Dataset(
+        {variable: (dims, rng.random(shape)) for variable in ["tp", "t2m"]},
+        coords=coords,
+    )
+
+
+def legacy_to_df(array, variables, variables_rename):
+
+    df = array.to_dataframe()
+
+    df["date"] = df.reset_index()["time"].dt.date.values
+    df["date"] = df["date"].apply(lambda el: el.strftime("%Y-%m-%d"))
+    df["timestamp"] = datetime.now()
+    df["timestamp"] = df["timestamp"].dt.strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+    df = (
+        df.rename(columns=dict(zip(variables, variables_rename)))
+        .reset_index()
+        .drop(columns=["time"])
+    )
+
+    if "step" in df.columns:
+        df = pd.concat(
+            [
+                df.groupby(["reservoir", "date", "timestamp"])[variable].apply(list)
+                for variable in variables_rename
+            ],
+            axis=1,
+        )
+        df = df.reset_index()
+
+    return df
+
+
+def timeit(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - tic)
+    return min(times), result
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reservoirs", type=int, default=20)
+    parser.add_argument("--days", type=int, default=1461)
+    parser.add_argument("--steps", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    array = make_reduced(args.reservoirs, args.days, args.steps)
+    variables, variables_rename = ["tp", "t2m"], ["values_precip", "values_temp"]
+
+    legacy_s, legacy_df = timeit(
+        lambda: legacy_to_df(array, variables, variables_rename), args.repeat
+    )
+    new_s, new_df = timeit(
+        lambda: reduced_to_df(array, variables, variables_rename), args.repeat
+    )
+
+    assert len(legacy_df) == len(new_df)
+    assert sorted(legacy_df.columns) == sorted(new_df.columns)
+
+    print(
+        f"{args.reservoirs} reservoirs x {args.days} days x {args.steps} steps: "
+        f"legacy {legacy_s:.3f}s, vectorized {new_s:.3f}s, speedup {legacy_s / new_s:.1f}x"
+    )
@@ -0,0 +1,168 @@
+"""
+Offline benchmark of the reduction pipeline on synthetic archives and basins (see `synthetic.py`).
+
+For each combination of archive kind, grid resolution, time span and basin shape, the mask, reduce (graph + dask
+compute) and assemble stages of `reduce_timeperiod_to_df` are timed separately, using the pipeline's own stage
+instrumentation, together with the bytes read from the archive. One json line per run is appended to `--out`,
+tagged with `--label`, so runs on different commits can be compared:
+
+    python bench/bench_pipeline.py --label before --out bench/results.jsonl
+    python bench/bench_pipeline.py --label after --out bench/results.jsonl
+    python bench/bench_pipeline.py --compare before after --out bench/results.jsonl
+
+Archives are written to `--data-dir` once and reused. `--quick` runs a small matrix.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from loguru import logger
+
+from synthetic import make_archive, make_basins
+
+from h2ox.reducer.instrumentation import get_metrics
+from h2ox.reducer.reducer import open_archive, reduce_timeperiod_to_df
+from h2ox.reducer.mappers import mapper_stats
+
+STAGES = ["mask", "compute", "assemble"]
+
+MATRIX = dict(
+    kind=["chirps", "tigge"],
+    resolution=[0.25, 0.1, 0.05],
+    days=[90, 730],
+    basins=[(10, 0.5, 200), (10, 2.0, 2000), (2, 4.0, 20000)],  # (n_basins, radius in degrees, vertices)
+)
+
+QUICK_MATRIX = dict(
+    kind=["chirps", "tigge"],
+    resolution=[0.25, 0.1],
+    days=[60],
+    basins=[(5, 1.0, 500)],
+)
+
+
+def git_rev():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_one(data_dir, kind, resolution, days, basins, steps, repeat, mask_cache_dir=None):
+    """Time the stages of one configuration, keeping the fastest of `repeat` runs of each stage."""
+
+    n_basins, radius, n_vertices = basins
+    target_spec = make_archive(
+        data_dir, kind=kind, resolution=resolution, days=days, steps=steps if kind == "tigge" else 0
+    )
+    if mask_cache_dir is not None:
+        target_spec["mask_cache"] = {"dir": mask_cache_dir}
+    gdf = make_basins(n_basins, radius, n_vertices)
+
+    best = {}
+    for _ in range(repeat):
+        zx_arr, mapper = open_archive(target_spec)
+        times = zx_arr["time"].values
+
+        metrics = get_metrics()
+        metrics.reset()
+        tic = time.perf_counter()
+        df = reduce_timeperiod_to_df(times[0], times[-1], target_spec, gdf, zx_arr=zx_arr)
+        total = time.perf_counter() - tic
+
+        stages = metrics.to_dict()
+        for name in STAGES:
+            best[name] = min(best.get(name, float("inf")), stages.get(name, {}).get("wall", 0))
+        best["total"] = min(best.get("total", float("inf")), total)
+        best["peak_rss"] = max(best.get("peak_rss", 0), max(el["peak_rss"] for el in stages.values()))
+        best["bytes_read"] = mapper_stats(mapper).get("bytes_read", 0)
+        best["rows"] = len(df)
+
+    return best
+
+
+def compare(out, labels):
+    """Print the per-configuration stage times of two labels in `out`, and their ratio."""
+
+    runs = defaultdict(dict)
+    with open(out) as f:
+        for line in f:
+            record = json.loads(line)
+            if record["label"] in labels:
+                runs[record["config"]][record["label"]] = record
+
+    for config, by_label in sorted(runs.items()):
+        if not all(label in by_label for label in labels):
+            continue
+        before, after = (by_label[label] for label in labels)
+        parts = [
+            f"{name} {before[name]:.3f}s -> {after[name]:.3f}s ({before[name] / max(after[name], 1e-9):.1f}x)"
+            for name in STAGES + ["total"]
+        ]
+        print(f"{config}: " + ", ".join(parts))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data-dir", default=os.path.join("bench", "data"))
+    parser.add_argument("--out", default=os.path.join("bench", "results.jsonl"))
+    parser.add_argument("--label", default=None, help="tag for this run, default: the git revision")
+    parser.add_argument("--steps", type=int, default=40, help="forecast steps of tigge-like archives")
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument("--mask-cache", default=None, help="optional mask cache dir, to time warm masks")
+    parser.add_argument("--compare", nargs=2, default=None, metavar=("LABEL_A", "LABEL_B"))
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare(args.out, args.compare)
+        raise SystemExit(0)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    label = args.label or git_rev()
+    matrix = QUICK_MATRIX if args.quick else MATRIX
+    mask_cache_dir = args.mask_cache
+
+    # keep the pipeline's own logging to warnings
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    for kind, resolution, days, basins in itertools.product(*matrix.values()):
+        config = f"{kind} res={resolution} days={days} basins={basins[0]}x(r={basins[1]}, v={basins[2]})"
+        result = run_one(
+            args.data_dir, kind, resolution, days, basins, args.steps, args.repeat, mask_cache_dir
+        )
+
+        record = dict(
+            label=label,
+            git_rev=git_rev(),
+            config=config,
+            kind=kind,
+            resolution=resolution,
+            days=days,
+            steps=args.steps if kind == "tigge" else 0,
+            n_basins=basins[0],
+            radius=basins[1],
+            vertices=basins[2],
+            **result,
+        )
+        with open(args.out, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+        print(
+            f"{config}: "
+            + ", ".join(f"{name} {result[name]:.3f}s" for name in STAGES + ["total"])
+            + f", {result['bytes_read'] / 2**20:.1f}MB read"
+        )
@@ -0,0 +1,154 @@
+"""
+Synthetic CHIRPS-like (time, latitude, longitude) and TIGGE-like (time, step, latitude, longitude) zarr archives,
+and synthetic basin polygons, for benchmarking without GCS or BigQuery.
+"""
+
+import os
+
+import dask.array as da
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import xarray as xr
+from shapely import geometry
+
+# the archives' variables and their BigQuery names, as in the target_spec
+KINDS = {
+    "chirps": dict(variables=["precip"], variables_rename=["value"]),
+    "tigge": dict(variables=["tp", "t2m"], variables_rename=["values_precip", "values_temp"]),
+}
+
+
+def archive_path(data_dir, kind, resolution, days, steps=0, extent=20.0):
+    name = f"{kind}_res{resolution}_days{days}_steps{steps}_ext{extent}.zarr"
+    return os.path.join(data_dir, name)
+
+
+def make_archive(
+    data_dir,
+    kind="chirps",
+    resolution=0.1,
+    days=365,
+    steps=0,
+    extent=20.0,
+    start="2015-01-01",
+    time_chunk=365,
+    spatial_chunk=100,
+):
+    """Write a synthetic archive to `data_dir`, unless it already exists, and return its target_spec.
+
+    Grids are regular, descending in latitude, over an `extent` x `extent` degree box at 60E, 10N.
+    Values are float32 with some non-positive values and NaNs, like the real archives.
+
+    Args:
+        data_dir (str): the directory to write archives to
+        kind (str): 'chirps' (time, lat, lon) or 'tigge' (time, step, lat, lon), see KINDS
+        resolution (float): grid spacing in degrees
+        days (int): number of daily time steps
+        steps (int): number of 6-hourly forecast steps, tigge only
+        extent (float): grid size in degrees
+        start (str): the first date
+        time_chunk (int): chunk size along time
+        spatial_chunk (int): chunk size along latitude and longitude
+    Returns:
+        dict: a target_spec for the archive, as for `reduce_timeperiod_to_df`
+    """
+
+    assert kind in KINDS, f"'kind' must be one of {list(KINDS)}"
+
+    path = archive_path(data_dir, kind, resolution, days, steps, extent)
+    spec = dict(
+        url="file://" + os.path.abspath(path),
+        lat_col="latitude",
+        lon_col="longitude",
+        **KINDS[kind],
+    )
+    if os.path.exists(path):
+        return spec
+
+    lons = np.round(np.arange(60, 60 + extent, resolution), 6)
+    lats = np.round(np.arange(10 + extent, 10, -resolution), 6)
+    times = pd.date_range(start, periods=days, freq="1D")
+
+    coords = dict(time=times, latitude=lats, longitude=lons)
+    dims = ("time", "latitude", "longitude")
+    chunks = dict(time=time_chunk, latitude=spatial_chunk, longitude=spatial_chunk)
+    if kind == "tigge":
+        coords["step"] = pd.to_timedelta(np.arange(steps) * 6, unit="h")
+        dims = ("time", "step", "latitude", "longitude")
+        chunks["step"] = -1
+
+    rng = np.random.default_rng(0)
+    shape = tuple(len(coords[dim]) for dim in dims)
+    zarr_chunks = tuple(shape[ii] if chunks[dim] == -1 else chunks[dim] for ii, dim in enumerate(dims))
+
+    ds = xr.Dataset(
+        {
+            variable: (dims, da.zeros(shape, chunks=zarr_chunks, dtype=np.float32))
+            for variable in KINDS[kind]["variables"]
+        },
+        coords=coords,
+    )
+
+    # write the metadata, then the values time chunk by time chunk so memory stays bounded
+    ds.to_zarr(path, mode="w", compute=False, consolidated=True)
+    for start_idx in range(0, days, time_chunk):
+        stop_idx = min(start_idx + time_chunk, days)
+        block_shape = (stop_idx - start_idx,) + shape[1:]
+        block = xr.Dataset(
+            {
+                variable: (
+                    dims,
+                    _synthetic_values(rng, block_shape),
+                )
+                for variable in KINDS[kind]["variables"]
+            }
+        )
+        block.chunk({dim: chunks[dim] for dim in dims}).to_zarr(
+            path, region=dict(time=slice(start_idx, stop_idx))
+        )
+
+    return spec
+
+
+def _synthetic_values(rng, shape):
+    values = rng.gamma(0.5, 2.0, size=shape).astype(np.float32) - 0.2
+    values[rng.random(shape) < 0.001] = np.nan
+    return values
+
+
+def make_basin(center, radius, n_vertices, roughness=0.2, seed=0):
+    """A star-shaped basin polygon of about `radius` degrees with `n_vertices` vertices and a rough outline."""
+
+    rng = np.random.default_rng(seed)
+    theta = np.linspace(0, 2 * np.pi, n_vertices, endpoint=False)
+
+    # smooth lobes plus small-scale noise, like a digitised watershed boundary
+    lobes = sum(
+        rng.uniform(0, roughness) * np.sin(k * theta + rng.uniform(0, 2 * np.pi))
+        for k in range(2, 8)
+    )
+    noise = roughness * 0.1 * rng.standard_normal(n_vertices)
+    r = radius * np.clip(1 + lobes + noise, 0.2, None)
+
+    return geometry.Polygon(
+        np.column_stack([center[0] + r * np.cos(theta), center[1] + r * np.sin(theta)])
+    ).buffer(0)
+
+
+def make_basins(n_basins, radius, n_vertices, extent=20.0, roughness=0.2, seed=0):
+    """`n_basins` basins scattered within the synthetic grid, as a GeoDataFrame indexed by name."""
+
+    rng = np.random.default_rng(seed)
+    # the lobes add at most 6 * roughness to the radius, the noise hardly ever more than 0.4 * roughness
+    margin = radius * (1 + 6.4 * roughness) + 0.5
+    centers = rng.uniform(margin, extent - margin, size=(n_basins, 2)) + np.array([60, 10])
+
+    return gpd.GeoDataFrame(
+        geometry=[
+            make_basin(center, radius, n_vertices, roughness=roughness, seed=seed + ii)
+            for ii, center in enumerate(centers)
+        ],
+        index=pd.Index([f"basin_{ii}" for ii in range(n_basins)], name="name"),
+        crs="EPSG:4326",
+    )
@@ -1,7 +1,7 @@
 __version__ = "0.0.1"
 
 from h2ox.reducer.bq_client import BQClient
-from h2ox.reducer.xr_reducer import XRReducer
+from h2ox.reducer.xr_reducer import XRReducer, MultiGeometryReducer
 from h2ox.reducer.reducer import reduce_timeperiod_to_df
 
-__all__ = ["__version__","XRReducer","BQClient","reduce_timeperiod_to_df"]
\ No newline at end of file
+__all__ = ["__version__","XRReducer","MultiGeometryReducer","BQClient","reduce_timeperiod_to_df"]
\ No newline at end of file
@@ -0,0 +1,213 @@
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import fsspec
+import geopandas as gpd
+import pandas as pd
+from google.api_core import exceptions
+from loguru import logger
+
+WAREHOUSE_BACKENDS = ["bigquery", "local"]
+TOKEN_BACKENDS = ["gcs", "local"]
+
+
+class LocalWarehouse:
+    """A local stand-in for BQClient, keeping each table as a directory of Parquet files.
+
+    Reservoirs are read from `<root>/tracked_reservoirs.parquet`, with 'name' and 'upstream_geom' (WKT)
+    columns as in BigQuery. Each push appends one Parquet file to `<root>/<table_str>/`.
+
+    Args:
+        root (str): the local directory (or any fsspec url) to keep the tables in
+    """
+
+    def __init__(self, root: str):
+
+        self.root = root
+        self.fs, self.fs_root = fsspec.core.url_to_fs(root)
+        self._lock = threading.Lock()
+
+    def _path(self, *parts) -> str:
+        return "/".join([self.fs_root.rstrip("/")] + list(parts))
+
+    def get_reservoir_gdf(self, columns=None) -> gpd.GeoDataFrame:
+
+        columns = list(columns or [])
+        with self.fs.open(self._path("tracked_reservoirs.parquet"), "rb") as f:
+            df = pd.read_parquet(f, columns=["name", "upstream_geom"] + columns)
+
+        return gpd.GeoDataFrame(
+            df[["name"] + columns],
+            geometry=gpd.GeoSeries.from_wkt(df["upstream_geom"].values),
+            crs="EPSG:4326",
+        ).set_index("name")
+
+    def get_reservoir_modified(self) -> datetime.datetime:
+        return self.fs.modified(self._path("tracked_reservoirs.parquet"))
+
+    def _read_table(self, table_str: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+
+        paths = sorted(self.fs.glob(self._path(table_str, "*.parquet")))
+        frames = []
+        for path in paths:
+            with self.fs.open(path, "rb") as f:
+                frames.append(pd.read_parquet(f, columns=columns))
+
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
+
+    def get_most_recent_dates(self, table_str: str, since=None) -> pd.DataFrame:
+
+        df = self._read_table(table_str, columns=["reservoir", "date"])
+        if since is not None:
+            df = df.loc[df["date"] >= pd.Timestamp(since).strftime("%Y-%m-%d")]
+
+        df = df.groupby("reservoir", as_index=False)["date"].max()
+        df["date"] = pd.to_datetime(df["date"])
+
+        return df
+
+    def push_data(self, table_str: str, df: pd.DataFrame) -> List[Dict]:
+
+        if len(df) == 0:
+            return []
+
+        tic = time.time()
+        path = self._path(table_str, f"{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet")
+        with self._lock:
+            self.fs.makedirs(self._path(table_str), exist_ok=True)
+        with self.fs.open(path, "wb") as f:
+            df.to_parquet(f, index=False)
+
+        return [
+            {
+                "rows": len(df),
+                "bytes": self.fs.size(path),
+                "latency": time.time() - tic,
+                "retries": 0,
+                "failed": 0,
+                "unsent": 0,
+                "errors": [],
+                "failed_reservoirs": [],
+            }
+        ]
+
+
+def get_warehouse(warehouse_spec: Optional[dict] = None):
+    """The results warehouse: a BQClient, or a LocalWarehouse.
+
+    Selected by warehouse_spec (e.g. target_spec['warehouse']) or the WAREHOUSE_BACKEND and
+    WAREHOUSE_DIR env variables. warehouse_spec may contain:
+        backend (str): one of WAREHOUSE_BACKENDS, default 'bigquery'
+        dir (str): the LocalWarehouse root
+        tables (dict): BigQuery table names, overriding the defaults per table_str
+    """
+
+    warehouse_spec = dict(warehouse_spec or {})
+    backend = warehouse_spec.get("backend", os.environ.get("WAREHOUSE_BACKEND", "bigquery"))
+    assert backend in WAREHOUSE_BACKENDS, f"'backend' must be one of {WAREHOUSE_BACKENDS}"
+
+    if backend == "local":
+        root = warehouse_spec.get("dir", os.environ.get("WAREHOUSE_DIR"))
+        assert root is not None, "a local warehouse needs a 'dir' or the WAREHOUSE_DIR env variable"
+        logger.info(f"Using a local warehouse in {root}")
+        return LocalWarehouse(root)
+
+    from h2ox.reducer.bq_client import BQClient
+
+    return BQClient(tables=warehouse_spec.get("tables"))
+
+
+class GCSTokenStore:
+    """Read token json files from GCS, as bucket/path/to/token.json.
+
+    Tokens are cached in memory by generation for the life of the process (e.g. a warm instance):
+    re-reading an unchanged token is a conditional request answered with 304 Not Modified, no body.
+    """
+
+    _cache: Dict[str, Tuple[int, bytes]] = {}
+    _lock = threading.Lock()
+
+    def read(self, path: str) -> bytes:
+        from h2ox.reducer.gcp_utils import http_timeout, storage_client
+
+        bucket_id, file_path = path.split("/", 1)
+        blob = storage_client().bucket(bucket_id).blob(file_path)
+
+        with self._lock:
+            cached = self._cache.get(path)
+
+        try:
+            if cached is not None:
+                content = blob.download_as_bytes(
+                    if_generation_not_match=cached[0], timeout=http_timeout()
+                )
+            else:
+                content = blob.download_as_bytes(timeout=http_timeout())
+        except exceptions.NotModified:
+            # only conditional requests, with a cached generation, are answered 304
+            assert cached is not None
+            logger.debug(f"Token {path} unchanged at generation {cached[0]}")
+            return cached[1]
+
+        if blob.generation is not None:
+            with self._lock:
+                self._cache[path] = (blob.generation, content)
+
+        return content
+
+    def read_json(self, path: str) -> Dict:
+        return json.loads(self.read(path))
+
+
+class LocalTokenStore:
+    """Read token json files from a local path, or any fsspec url."""
+
+    def read(self, path: str) -> bytes:
+        with fsspec.open(path, "rb") as f:
+            return f.read()
+
+    def read_json(self, path: str) -> Dict:
+        return json.loads(self.read(path))
+
+
+def get_token_store(token_spec: Optional[dict] = None):
+    """The token store, selected by token_spec['backend'] or the TOKEN_BACKEND env variable, default 'gcs'."""
+
+    token_spec = token_spec or {}
+    backend = token_spec.get("backend", os.environ.get("TOKEN_BACKEND", "gcs"))
+    assert backend in TOKEN_BACKENDS, f"'backend' must be one of {TOKEN_BACKENDS}"
+
+    if backend == "local":
+        return LocalTokenStore()
+    return GCSTokenStore()
+
+
+def read_token_dates(
+    token_store, tigge_token_path: str, chirps_token_path: str
+) -> Tuple[datetime.datetime, datetime.datetime]:
+    """Read the TIGGE and CHIRPS tokens concurrently, into memory, and parse their dates.
+
+    Returns:
+        Tuple[datetime, datetime]: (tigge_dt, chirps_dt), the most recent complete TIGGE day
+            (the day before 'most_recent_tigge') and the 'last_prelim' CHIRPS day
+    """
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        tigge_token, chirps_token = executor.map(
+            token_store.read_json, [tigge_token_path, chirps_token_path]
+        )
+
+    tigge_dt = datetime.datetime.strptime(
+        tigge_token["most_recent_tigge"], "%Y-%m-%d"
+    ) - datetime.timedelta(days=1)
+    chirps_dt = datetime.datetime.strptime(chirps_token["last_prelim"], "%Y-%m-%d")
+
+    return tigge_dt, chirps_dt
@@ -1,21 +1,109 @@
 import datetime
+import io
 import json
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from math import ceil
+from typing import Dict, List, Optional, Set, TypedDict, Union
 
 import pandas as pd
 import geopandas as gpd
-from shapely import geometry, wkt
+from shapely import geometry
 import requests
+from google.api_core import exceptions
 from google.cloud import bigquery
 from loguru import logger
 from tqdm import tqdm
 
+from h2ox.reducer.gcp_utils import bigquery_client
+from h2ox.reducer.watermark import LocalWatermark, TableWatermark, get_watermark
+
+
+# insert_rows_json error reasons worth retrying; 'stopped' rows were only rejected alongside bad rows
+RETRY_REASONS = {"stopped", "backendError", "internalError", "timeout", "rateLimitExceeded"}
+PUSH_METHODS = ["auto", "stream", "load"]
+
+
+class PushStats(TypedDict):
+    """The stats of one streamed batch or load job, see `BQClient.push_data`"""
+
+    rows: int
+    bytes: int
+    latency: float
+    retries: int
+    failed: int
+    unsent: int
+    errors: List[dict]
+    failed_reservoirs: List[str]
+
+
+def new_push_stats(rows: int = 0, n_bytes: int = 0) -> PushStats:
+    return {
+        "rows": rows,
+        "bytes": n_bytes,
+        "latency": 0.0,
+        "retries": 0,
+        "failed": 0,
+        "unsent": 0,
+        "errors": [],
+        "failed_reservoirs": [],
+    }
+
 
 class BQClient:
-    def __init__(self):
+    """Read reservoirs and push reduced data to BigQuery.
+
+    With push_method='auto', small pushes are streamed with insert_rows_json and pushes over
+    `stream_max_rows` rows are written to in-memory Parquet and appended with load jobs of at most
+    `load_chunk_rows` rows each, which avoids streaming quotas and request-size limits and makes the
+    rows immediately available for DML. push_method='stream' or 'load' forces either path.
+
+    Streamed rows are sent in batches of at most `batch_rows` rows and `batch_bytes` bytes through
+    `stream_workers` threads. Rows failing with a transient reason are retried up to `max_retries` times.
+
+    Args:
+        client (bigquery.Client): optional client, or any stand-in with the same methods, default: the shared client
+        push_method (str): one of PUSH_METHODS, default: the BQ_PUSH_METHOD env variable or 'auto'
+        stream_max_rows (int): the largest push to stream with push_method='auto'
+        load_chunk_rows (int): the most rows per load job
+        batch_rows (int): the most rows per streaming insert request
+        batch_bytes (int): the most json-encoded bytes per streaming insert request
+        stream_workers (int): the number of concurrent streaming insert requests
+        max_retries (int): the most retries of a streamed batch's failed rows
+        watermark (LocalWatermark | TableWatermark): optional most recent pushed dates, which
+            bound the most-recent-date queries; default: from the WATERMARK_PATH or WATERMARK_TABLE env variables
+        tables (Dict[str, str]): table names overriding the defaults per table_str, as does the
+            json-parseable BQ_TABLES env variable
+    """
 
-        self.client = bigquery.Client()
+    def __init__(
+        self,
+        client=None,
+        push_method: Optional[str] = None,
+        stream_max_rows: int = 500,
+        load_chunk_rows: int = 250_000,
+        batch_rows: int = 500,
+        batch_bytes: int = 8 * 2**20,
+        stream_workers: int = 4,
+        max_retries: int = 3,
+        watermark: Optional[Union[LocalWatermark, TableWatermark]] = None,
+        tables: Optional[Dict[str, str]] = None,
+    ):
+
+        self.client = client if client is not None else bigquery_client()
+        self.push_method = push_method or os.environ.get("BQ_PUSH_METHOD", "auto")
+        assert self.push_method in PUSH_METHODS, f"'push_method' must be one of {PUSH_METHODS}"
+        self.stream_max_rows = stream_max_rows
+        self.load_chunk_rows = load_chunk_rows
+        self.batch_rows = batch_rows
+        self.batch_bytes = batch_bytes
+        self.stream_workers = stream_workers
+        self.max_retries = max_retries
+        self._schemas: Dict[str, List[bigquery.SchemaField]] = {}
+        self.watermark = watermark if watermark is not None else get_watermark(self.client)
+        # the watermarks last read or written, per table_str, so only increases are written
+        self._watermarks: Dict[str, Dict] = {}
 
         self.min_dt = datetime.datetime(2010, 1, 1)
 
@@ -25,6 +113,10 @@ class BQClient:
              'forecast_data':"oxeo-main.wave2web.forecast",
              'precip_data':"oxeo-main.wave2web.precipitation",
         }
+        if os.environ.get("BQ_TABLES") is not None:
+            self.tables.update(json.loads(os.environ["BQ_TABLES"]))
+        if tables is not None:
+            self.tables.update(tables)
 
 
     def check_errors(self, errors):
@@ -47,21 +139,31 @@ class BQClient:
 
         return df
     
-    def get_reservoir_gdf(self):
+    def get_reservoir_gdf(self, columns=None):
+        """The tracked reservoirs' upstream geometries, indexed by name, plus any extra `columns`."""
+
+        columns = list(columns or [])
 
         Q = f"""
-            SELECT *
+            SELECT {", ".join(["name", "upstream_geom"] + columns)}
             FROM `{self.tables["tracked_reservoirs"]}`
         """
 
         df = self.client.query(Q).result().to_dataframe()
-        
-        df['upstream_geom'] = df['upstream_geom'].apply(wkt.loads)
-        
-        gdf = gpd.GeoDataFrame(df, geometry='upstream_geom',crs='EPSG:4326').rename(columns={'upstream_geom':'geometry'}).set_index('name')
+
+        gdf = gpd.GeoDataFrame(
+            df[["name"] + columns],
+            geometry=gpd.GeoSeries.from_wkt(df['upstream_geom'].values),
+            crs='EPSG:4326',
+        ).set_index('name')
 
         return gdf
 
+    def get_reservoir_modified(self):
+        """The last-modified time of the tracked reservoirs table"""
+
+        return self.client.get_table(self.tables["tracked_reservoirs"]).modified
+
     def get_most_recent_date(self, table_str: str, uuid: str):
 
         Q = f"""
@@ -74,34 +176,295 @@ class BQClient:
 
         return df.iloc[0]["f0_"].replace(tzinfo=None)
     
-    def get_most_recent_dates(self, table_str: str):
+    def get_most_recent_dates(self, table_str: str, since=None):
+        """The most recent date of each reservoir in a table.
+
+        Only the reservoir and date columns are scanned, and `since` (or, if set, the lowest
+        watermark) bounds the date range so date-partitioned tables are pruned. Reservoirs without
+        rows in that range keep their watermark.
+
+        Returns:
+            pd.DataFrame: 'reservoir' and 'date' columns
+        """
+
+        watermarks = self.watermark.get(table_str) if self.watermark is not None else {}
+        self._watermarks[table_str] = dict(watermarks)
+        if since is None and len(watermarks) > 0:
+            since = min(watermarks.values())
+
+        where = f"WHERE date >= '{pd.Timestamp(since).strftime('%Y-%m-%d')}'" if since is not None else ""
 
         Q = f"""
-            SELECT t.*
-            FROM (SELECT t.*,
-                         ROW_NUMBER() OVER (PARTITION BY reservoir
-                                            ORDER BY date DESC
-                                           ) as seqnum
-                  FROM `{self.tables[table_str]}` as t
-                 ) t
-            WHERE seqnum = 1;
+            SELECT reservoir, MAX(date) AS date
+            FROM `{self.tables[table_str]}`
+            {where}
+            GROUP BY reservoir
         """
 
         df = self.client.query(Q).result().to_dataframe()
         df['date'] = pd.to_datetime(df['date'])
 
+        if len(watermarks) > 0:
+            df = (
+                pd.concat([df, pd.DataFrame({'reservoir': list(watermarks), 'date': list(watermarks.values())})])
+                .groupby('reservoir', as_index=False)['date']
+                .max()
+            )
+
+        self.update_watermarks(table_str, df.set_index('reservoir')['date'].to_dict())
+
+        return df
+
+    def update_watermarks(self, table_str: str, dates: Dict):
+        """Write the watermarks of the reservoirs whose date is above their known watermark, if any."""
+
+        if self.watermark is None:
+            return
+
+        if table_str not in self._watermarks:
+            self._watermarks[table_str] = dict(self.watermark.get(table_str))
+        known = self._watermarks[table_str]
+
+        increased = {
+            reservoir: pd.Timestamp(date)
+            for reservoir, date in dates.items()
+            if reservoir not in known or pd.Timestamp(date) > known[reservoir]
+        }
+        if len(increased) > 0:
+            self.watermark.update(table_str, increased)
+            known.update(increased)
+
+    def get_schema(self, table_str: str):
+        """The (cached) schema of one of self.tables"""
+
+        if table_str not in self._schemas:
+            self._schemas[table_str] = self.client.get_table(self.tables[table_str]).schema
+
+        return self._schemas[table_str]
+
+    @staticmethod
+    def coerce_to_schema(df: pd.DataFrame, schema) -> pd.DataFrame:
+        """Convert the string 'date' and 'timestamp' style columns of df to the types of the table schema."""
+
+        df = df.copy()
+        for field in schema:
+            if field.name not in df.columns:
+                continue
+            if field.field_type == "DATE":
+                df[field.name] = pd.to_datetime(df[field.name]).dt.date
+            elif field.field_type == "DATETIME":
+                df[field.name] = pd.to_datetime(df[field.name])
+            elif field.field_type == "TIMESTAMP":
+                df[field.name] = pd.to_datetime(df[field.name], utc=True)
+
         return df
 
-    def push_data(self, table_str: str, df: pd.DataFrame):
+    def make_batches(self, rows: List[dict]) -> List[List[dict]]:
+        """Split rows into batches of at most self.batch_rows rows and self.batch_bytes json-encoded bytes."""
+
+        batches: List[List[dict]] = []
+        batch: List[dict] = []
+        batch_size = 0
+        for row in rows:
+            row_size = len(json.dumps(row, default=str))
+            if batch and (len(batch) >= self.batch_rows or batch_size + row_size > self.batch_bytes):
+                batches.append(batch)
+                batch, batch_size = [], 0
+            batch.append(row)
+            batch_size += row_size
+        if batch:
+            batches.append(batch)
+
+        return batches
+
+    def insert_batch(
+        self, table_str: str, rows: List[dict], failed_reservoirs: Optional[Set] = None
+    ) -> PushStats:
+        """Stream one batch, retrying only its transiently failed rows.
+
+        Rows of reservoirs in `failed_reservoirs` are not sent. Once a row fails permanently, its
+        reservoir is added to `failed_reservoirs` and none of that reservoir's other rows are retried,
+        so no later date of a reservoir lands after one of its rows failed.
+
+        Returns:
+            PushStats: rows, bytes, latency, retries, failed and unsent rows, the errors of the
+                failed rows and the reservoirs that failed in this batch
         """
-        df: a long-form dataframe indexed by (date, reservoir_name), remaining columns are data columns
+
+        tic = time.time()
+        failed_reservoirs = failed_reservoirs if failed_reservoirs is not None else set()
+        batch_failed = set()
+        stats = new_push_stats(len(rows), sum(len(json.dumps(row, default=str)) for row in rows))
+
+        pending = [row for row in rows if row.get("reservoir") not in failed_reservoirs]
+        stats["unsent"] += len(rows) - len(pending)
+
+        while pending:
+            try:
+                errors = self.client.insert_rows_json(self.tables[table_str], pending)
+            except Exception as e:  # e.g. a BadRequest, or a dropped connection: no row landed
+                # the payload is over the request size limit: split it rather than fail every row
+                if isinstance(e, exceptions.BadRequest) and len(pending) > 1 and "size" in str(e).lower():
+                    half = len(pending) // 2
+                    for part in (pending[:half], pending[half:]):
+                        part_stats = self.insert_batch(table_str, part, failed_reservoirs)
+                        stats["retries"] += part_stats["retries"]
+                        stats["failed"] += part_stats["failed"]
+                        stats["unsent"] += part_stats["unsent"]
+                        stats["errors"] += part_stats["errors"]
+                        batch_failed.update(part_stats["failed_reservoirs"])
+                    break
+                errors = [
+                    {"index": ii, "errors": [{"reason": type(e).__name__, "message": str(e)}]}
+                    for ii in range(len(pending))
+                ]
+
+            retry_rows = []
+            for error in errors:
+                reasons = {el.get("reason") for el in error["errors"]}
+                if reasons <= RETRY_REASONS:
+                    retry_rows.append(pending[error["index"]])
+                else:
+                    stats["failed"] += 1
+                    stats["errors"].append(error)
+                    batch_failed.add(pending[error["index"]].get("reservoir"))
+
+            if retry_rows and stats["retries"] >= self.max_retries:
+                stats["failed"] += len(retry_rows)
+                stats["errors"] += [{"errors": [{"reason": "retries exhausted"}]}] * len(retry_rows)
+                batch_failed.update(row.get("reservoir") for row in retry_rows)
+                retry_rows = []
+
+            # don't retry the other rows of failed reservoirs, which may be dated after the failed rows
+            failed_reservoirs.update(batch_failed)
+            kept_rows = [row for row in retry_rows if row.get("reservoir") not in failed_reservoirs]
+            stats["unsent"] += len(retry_rows) - len(kept_rows)
+
+            if kept_rows:
+                stats["retries"] += 1
+                time.sleep(min(2 ** stats["retries"], 30) * 0.1)
+
+            pending = kept_rows
+
+        failed_reservoirs.update(batch_failed)
+        stats["failed_reservoirs"] = sorted(str(reservoir) for reservoir in batch_failed)
+        stats["latency"] = time.time() - tic
+
+        return stats
+
+    def stream_data(self, table_str: str, df: pd.DataFrame) -> List[PushStats]:
+        """Stream df to a table in bounded batches, in date order per reservoir.
+
+        The next run resumes each reservoir after its most recent date, so each reservoir's rows
+        must land in date order: reservoirs are split into `stream_workers` lanes streamed
+        concurrently, and each lane sends its batches one after another, earliest dates first.
+        Once a row of a reservoir fails permanently, none of that reservoir's later rows are sent,
+        while the other reservoirs' rows still land. Failed reservoirs are logged and listed in the
+        returned stats; the next run resumes them from their first failed date.
+        """
+
+        if "date" in df.columns:
+            df = df.sort_values("date", kind="stable")
+        rows = df.to_dict(orient="records")
+
+        if "reservoir" in df.columns:
+            reservoirs = sorted(df["reservoir"].unique())
+            lanes: List[List[dict]] = [[] for _ in range(min(self.stream_workers, len(reservoirs)))]
+            lane_idx = {reservoir: ii % len(lanes) for ii, reservoir in enumerate(reservoirs)}
+            for row in rows:
+                lanes[lane_idx[row["reservoir"]]].append(row)
+        else:
+            lanes = [rows]
+
+        def send(lane_rows: List[dict]) -> List[PushStats]:
+            failed_reservoirs: Set = set()
+            return [
+                self.insert_batch(table_str, batch, failed_reservoirs)
+                for batch in self.make_batches(lane_rows)
+            ]
+
+        with ThreadPoolExecutor(max_workers=self.stream_workers) as pool:
+            stats = [el for lane_stats in pool.map(send, lanes) for el in lane_stats]
+
+        failed_reservoirs = sorted({name for el in stats for name in el["failed_reservoirs"]})
+        if failed_reservoirs:
+            logger.error(
+                f"{sum(el['failed'] for el in stats)} of {len(df)} rows failed to stream to {table_str}, "
+                f"and {sum(el['unsent'] for el in stats)} later rows of their reservoirs were not sent. "
+                f"Failed reservoirs: {failed_reservoirs[:20]}, errors: "
+                + str([error for el in stats for error in el["errors"]][:10])
+            )
+
+        return stats
+
+    def load_data(self, table_str: str, df: pd.DataFrame) -> List[PushStats]:
+        """Append df to a table with Parquet load jobs of at most self.load_chunk_rows rows.
+
+        Jobs are loaded earliest dates first, so a failed job, which raises, leaves no reservoir
+        with a later date landed than one that didn't.
         """
 
-        errors = self.client.insert_rows_json(
-            self.tables[table_str], df.to_dict(orient="records")
+        if "date" in df.columns:
+            df = df.sort_values("date", kind="stable")
+
+        schema = self.get_schema(table_str)
+
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+            schema=schema,
         )
+        # map list columns (e.g. per-step forecasts) to REPEATED fields
+        parquet_options = bigquery.format_options.ParquetOptions()
+        parquet_options.enable_list_inference = True
+        job_config.parquet_options = parquet_options
 
-        self.check_errors(errors)
+        stats: List[PushStats] = []
+        n_chunks = ceil(len(df) / self.load_chunk_rows)
+        for ii in range(n_chunks):
+            tic = time.time()
+            chunk = df.iloc[ii * self.load_chunk_rows : (ii + 1) * self.load_chunk_rows]
 
-        return True
+            buffer = io.BytesIO()
+            self.coerce_to_schema(chunk, schema).to_parquet(buffer, index=False)
+            n_bytes = buffer.tell()
+            buffer.seek(0)
+
+            job = self.client.load_table_from_file(
+                buffer, self.tables[table_str], job_config=job_config
+            )
+            job.result()
+
+            self.check_errors(job.errors or [])
+            logger.info(f"Loaded {len(chunk)} rows to {table_str} ({ii+1}/{n_chunks})")
+
+            chunk_stats = new_push_stats(len(chunk), n_bytes)
+            chunk_stats["latency"] = time.time() - tic
+            stats.append(chunk_stats)
+
+        return stats
+
+    def push_data(self, table_str: str, df: pd.DataFrame) -> List[PushStats]:
+        """
+        df: a long-form dataframe indexed by (date, reservoir_name), remaining columns are data columns
+
+        Returns a list of per-batch (or per-load-job) PushStats: rows, bytes, latency, retries,
+        failed and unsent rows, errors and failed reservoirs.
+        """
+
+        if len(df) == 0:
+            return []
+
+        if self.push_method == "stream" or (
+            self.push_method == "auto" and len(df) <= self.stream_max_rows
+        ):
+            stats = self.stream_data(table_str, df)
+        else:
+            stats = self.load_data(table_str, df)
+
+        # failed reservoirs keep their watermarks: the table's MAX(date) covers those of their rows that landed
+        failed_reservoirs = {name for el in stats for name in el["failed_reservoirs"]}
+        landed = df.loc[~df["reservoir"].astype(str).isin(failed_reservoirs)]
+        self.update_watermarks(table_str, landed.groupby("reservoir")["date"].max().to_dict())
 
+        return stats
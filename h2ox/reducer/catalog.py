@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import geopandas as gpd
+import numpy as np
+from loguru import logger
+from shapely import geometry
+
+
+def content_hash(gdf: gpd.GeoDataFrame) -> str:
+    """sha1 of the index and geometry WKB of a reservoir GeoDataFrame, independent of row order"""
+
+    h = hashlib.sha1()
+    for name, geom in sorted(zip(gdf.index.astype(str), gdf.geometry.to_wkb())):
+        h.update(name.encode())
+        h.update(geom)
+    return h.hexdigest()
+
+
+class GeometryCatalog:
+    """A local, pre-parsed cache of the tracked reservoir geometries.
+
+    The reservoirs are stored as GeoParquet in `cache_dir`, alongside the table's last-modified time
+    and a content hash. Within `check_interval` seconds of the last check, `load` reads the local copy
+    without touching BigQuery. After that it compares the table's last-modified time (a metadata call,
+    not a query) and only re-queries the table if it changed. A missing or corrupt local copy is
+    re-fetched.
+
+    Args:
+        bq_client (BQClient): the client to fetch the reservoirs with
+        cache_dir (str): the local directory to keep the catalog in
+        check_interval (float): seconds between last-modified checks, 0 to check on every load
+    """
+
+    def __init__(self, bq_client, cache_dir: str, check_interval: float = 3600):
+
+        self.bq_client = bq_client
+        self.cache_dir = cache_dir
+        self.check_interval = check_interval
+
+        self.gdf: Optional[gpd.GeoDataFrame] = None
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @property
+    def data_path(self) -> str:
+        return os.path.join(self.cache_dir, "reservoirs.parquet")
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.cache_dir, "reservoirs.json")
+
+    def _read_meta(self) -> Dict:
+        try:
+            with open(self.meta_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_meta(self, meta: Dict):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _read_local(self, meta: Dict) -> Optional[gpd.GeoDataFrame]:
+        try:
+            gdf = gpd.read_parquet(self.data_path)
+        except Exception as e:
+            logger.warning(f"Could not read geometry catalog {self.data_path}: {e}")
+            return None
+
+        if content_hash(gdf) != meta.get("content_hash"):
+            logger.warning(f"Geometry catalog {self.data_path} does not match its hash")
+            return None
+
+        return gdf
+
+    def _fetch(self, modified: Optional[str]) -> gpd.GeoDataFrame:
+
+        gdf = self.bq_client.get_reservoir_gdf()
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        gdf.to_parquet(tmp_path)
+        os.replace(tmp_path, self.data_path)
+
+        self._write_meta(
+            {
+                "modified": modified,
+                "content_hash": content_hash(gdf),
+                "checked_at": time.time(),
+            }
+        )
+        logger.info(f"Fetched {len(gdf)} reservoirs into geometry catalog {self.cache_dir}")
+
+        return gdf
+
+    def load(self) -> gpd.GeoDataFrame:
+        """The reservoir GeoDataFrame, as from BQClient.get_reservoir_gdf, refreshed only if the table changed."""
+
+        meta = self._read_meta()
+
+        if meta and time.time() - meta.get("checked_at", 0) < self.check_interval:
+            gdf = self._read_local(meta)
+            if gdf is not None:
+                self.gdf = gdf
+                return gdf
+
+        modified = self.bq_client.get_reservoir_modified()
+        modified = modified.isoformat() if modified is not None else None
+
+        gdf = None
+        if meta and modified is not None and meta.get("modified") == modified:
+            gdf = self._read_local(meta)
+            if gdf is not None:
+                meta["checked_at"] = time.time()
+                self._write_meta(meta)
+
+        if gdf is None:
+            gdf = self._fetch(modified)
+
+        self.gdf = gdf
+
+        return gdf
+
+    def query(self, bounds: Tuple[float, float, float, float]) -> List[str]:
+        """The reservoirs whose geometries intersect the (minx, miny, maxx, maxy) bounding box, via the spatial index."""
+
+        gdf = self.gdf if self.gdf is not None else self.load()
+
+        idx = gdf.sindex.query(geometry.box(*bounds), predicate="intersects")
+
+        return list(gdf.index[np.sort(idx)])
+
+    def chunk_reservoirs(
+        self,
+        lons: np.ndarray,
+        lats: np.ndarray,
+        lon_chunks: Tuple[int, ...],
+        lat_chunks: Tuple[int, ...],
+    ) -> Dict[Tuple[int, int], List[str]]:
+        """The reservoirs touching each (lon, lat) chunk of an archive grid.
+
+        Args:
+            lons (np.ndarray): the archive longitudes
+            lats (np.ndarray): the archive latitudes
+            lon_chunks (tuple): the archive's chunk sizes along longitude
+            lat_chunks (tuple): the archive's chunk sizes along latitude
+        Returns:
+            Dict[Tuple[int, int], List[str]]: the reservoirs of each non-empty chunk
+        """
+
+        lon_edges = np.cumsum((0,) + tuple(lon_chunks))
+        lat_edges = np.cumsum((0,) + tuple(lat_chunks))
+
+        # cells span lons[j]:lons[j+1] (see geoutils.get_mask), so each chunk's box runs to the
+        # next chunk's first coordinate, or to the grid edge
+        chunks = {}
+        for ii in range(len(lon_chunks)):
+            chunk_lons = lons[lon_edges[ii] : lon_edges[ii + 1] + 1]
+            for jj in range(len(lat_chunks)):
+                chunk_lats = lats[lat_edges[jj] : lat_edges[jj + 1] + 1]
+                reservoirs = self.query(
+                    (chunk_lons.min(), chunk_lats.min(), chunk_lons.max(), chunk_lats.max())
+                )
+                if reservoirs:
+                    chunks[(ii, jj)] = reservoirs
+
+        return chunks
+
+
+def get_catalog(bq_client, cache_dir: Optional[str] = None) -> Optional[GeometryCatalog]:
+    """A GeometryCatalog in `cache_dir` or the GEOMETRY_CATALOG_DIR env variable, if set."""
+
+    cache_dir = cache_dir or os.environ.get("GEOMETRY_CATALOG_DIR")
+    if cache_dir is None:
+        return None
+
+    return GeometryCatalog(
+        bq_client,
+        cache_dir,
+        check_interval=float(os.environ.get("GEOMETRY_CATALOG_CHECK_INTERVAL", 3600)),
+    )
@@ -0,0 +1,85 @@
+import json
+import os
+from contextlib import contextmanager
+from typing import Optional
+
+import dask
+from loguru import logger
+
+SCHEDULERS = ["threads", "processes", "synchronous", "distributed"]
+
+
+def get_dask_spec(target_spec: dict) -> Optional[dict]:
+    """Get the dask settings from target_spec['dask'] or the json-parseable REDUCER_DASK_SPEC env variable.
+
+    The settings may contain:
+        scheduler (str): one of SCHEDULERS
+        num_workers (int): the number of threads, processes, or LocalCluster workers
+        threads_per_worker (int): threads per LocalCluster worker
+        memory_limit (str): the memory limit per LocalCluster worker, e.g. '4GB'
+        local_cluster (bool): run a dask.distributed LocalCluster, same as scheduler='distributed'
+    """
+
+    dask_spec = target_spec.get("dask")
+    if dask_spec is None and os.environ.get("REDUCER_DASK_SPEC") is not None:
+        dask_spec = json.loads(os.environ["REDUCER_DASK_SPEC"])
+
+    return dask_spec
+
+
+@contextmanager
+def dask_scheduler(dask_spec: Optional[dict] = None):
+    """Context providing the dask scheduler described by `dask_spec`.
+
+    No process-global dask state is changed, since sources may run concurrently in threads, each
+    with its own scheduler: pass the yielded settings' 'compute_kwargs' to .compute() or .load().
+
+    Yields:
+        dict: the settings in effect, for logging, and the 'compute_kwargs' to compute with
+    """
+
+    if not dask_spec:
+        yield {"scheduler": dask.config.get("scheduler", "default"), "compute_kwargs": {}}
+        return
+
+    scheduler = dask_spec.get("scheduler", "threads")
+    if dask_spec.get("local_cluster", False):
+        scheduler = "distributed"
+    assert scheduler in SCHEDULERS, f"'scheduler' must be one of {SCHEDULERS}"
+
+    num_workers = dask_spec.get("num_workers")
+    memory_limit = dask_spec.get("memory_limit")
+
+    if scheduler == "distributed":
+        try:
+            from dask.distributed import Client, LocalCluster
+        except ImportError:
+            raise ImportError(
+                "A LocalCluster requires dask.distributed: pip install 'dask[distributed]'"
+            )
+
+        with LocalCluster(
+            n_workers=num_workers,
+            threads_per_worker=dask_spec.get("threads_per_worker"),
+            memory_limit=memory_limit if memory_limit is not None else "auto",
+        ) as cluster, Client(cluster, set_as_default=False) as client:
+            yield {
+                "scheduler": scheduler,
+                "num_workers": len(cluster.workers),
+                "threads": sum(client.nthreads().values()),
+                "memory_limit": memory_limit,
+                "dashboard": client.dashboard_link,
+                "compute_kwargs": {"scheduler": client},
+            }
+
+    else:
+        if memory_limit is not None:
+            logger.warning(
+                f"'memory_limit' only applies to a LocalCluster, ignoring it for scheduler={scheduler}"
+            )
+
+        compute_kwargs = {"scheduler": scheduler}
+        if num_workers is not None:
+            compute_kwargs["num_workers"] = num_workers
+
+        yield {"scheduler": scheduler, "num_workers": num_workers, "compute_kwargs": compute_kwargs}
@@ -1,17 +1,95 @@
-from typing import Dict, Optional
+from typing import Callable, Dict, Optional
 import datetime
 
 import io
 import json
+import os
+import threading
 import requests
 from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from google.cloud import bigquery
 from google.cloud import storage
 from google.cloud import tasks_v2
 from google.protobuf import timestamp_pb2
 from google.protobuf import duration_pb2
 
 
+# lazily created clients, shared by all calls (and threads) in this process, so auth discovery
+# and TLS handshakes happen once per process instead of once per call
+_CLIENTS: Dict[str, object] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def get_client(name: str, factory: Callable):
+    """Get the shared client `name`, creating it with `factory` on first use."""
+
+    client = _CLIENTS.get(name)
+    if client is None:
+        with _CLIENTS_LOCK:
+            client = _CLIENTS.get(name)
+            if client is None:
+                client = factory()
+                _CLIENTS[name] = client
+    return client
+
+
+def reset_clients():
+    """Drop the shared clients, e.g. in a forked child process."""
+    with _CLIENTS_LOCK:
+        _CLIENTS.clear()
+
+
+def http_timeout() -> float:
+    """Timeout in seconds for http requests and GCS transfers, from the HTTP_TIMEOUT env variable (default 60)."""
+    return float(os.environ.get("HTTP_TIMEOUT", 60))
+
+
+def _make_http_session() -> requests.Session:
+
+    retry = Retry(
+        total=int(os.environ.get("HTTP_RETRIES", 3)),
+        backoff_factor=float(os.environ.get("HTTP_BACKOFF", 0.5)),
+        status_forcelist=[429, 500, 502, 503, 504],
+    )
+    pool_size = int(os.environ.get("HTTP_POOL_SIZE", 10))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def http_session() -> requests.Session:
+    """The shared requests Session, with a connection pool and retries.
+
+    Configured by the HTTP_RETRIES (default 3), HTTP_BACKOFF (default 0.5s) and HTTP_POOL_SIZE
+    (default 10) env variables. Idempotent requests are retried on 429 and 5xx responses, all
+    requests on connection errors.
+    """
+    return get_client("http_session", _make_http_session)
+
+
+def storage_client(**kwargs) -> storage.Client:
+    """The shared GCS client, or a new one if any client `kwargs` are given."""
+    if kwargs:
+        return storage.Client(**kwargs)
+    return get_client("storage", storage.Client)
+
+
+def bigquery_client() -> bigquery.Client:
+    """The shared BigQuery client."""
+    return get_client("bigquery", bigquery.Client)
+
+
+def tasks_client() -> tasks_v2.CloudTasksClient:
+    """The shared Cloud Tasks client."""
+    return get_client("tasks", tasks_v2.CloudTasksClient)
+
+
 def create_task(cfg, payload, task_name, delay):
     """Create a task with a payload, and a delay in s
     
@@ -73,8 +151,8 @@ def create_task(cfg, payload, task_name, delay):
 
 def deploy_task(cfg, task):
     
-    # Create a client.
-    client = tasks_v2.CloudTasksClient()
+    # Get the shared client.
+    client = tasks_client()
     
     task["name"] = client.task_path(cfg['project'], cfg['location'], cfg['queue'], task["name"])
 
@@ -86,7 +164,9 @@ def deploy_task(cfg, task):
     )
     
     # Use the client to build and send the task.
-    response = client.create_task(request={"parent": parent, "task": task})
+    response = client.create_task(
+        request={"parent": parent, "task": task}, timeout=http_timeout()
+    )
 
     logger.info("Created task {}".format(response.name))
     
@@ -95,7 +175,7 @@ def deploy_task(cfg, task):
 
 def download_or_code(url,fname):
     
-    r = requests.get(url)
+    r = http_session().get(url, timeout=http_timeout())
     
     if r.status_code==200:
 
@@ -112,15 +192,13 @@ def download_blob(url: str) -> io.BytesIO:
     Returns:
         io.BytesIO: the content as bytes
     """
-    storage_client = storage.Client()
-    
     bucket_id = url.split('/')[0]
     file_path = '/'.join(url.split('/')[1:])
     
-    bucket = storage_client.bucket(bucket_id)
+    bucket = storage_client().bucket(bucket_id)
     blob = bucket.blob(file_path)
     
-    f = io.BytesIO(blob.download_as_bytes())
+    f = io.BytesIO(blob.download_as_bytes(timeout=http_timeout()))
     return f
     
 def download_blob_to_filename(url: str, local_path: str) -> int:
@@ -130,15 +208,13 @@ def download_blob_to_filename(url: str, local_path: str) -> int:
     Returns:
         io.BytesIO: the content as bytes
     """
-    storage_client = storage.Client()
-    
     bucket_id = url.split('/')[0]
     file_path = '/'.join(url.split('/')[1:])
     
-    bucket = storage_client.bucket(bucket_id)
+    bucket = storage_client().bucket(bucket_id)
     blob = bucket.blob(file_path)
     
-    blob.download_to_filename(local_path)
+    blob.download_to_filename(local_path, timeout=http_timeout())
     return 1
 
 
@@ -155,18 +231,17 @@ def upload_blob(source_directory: str, target_directory: str):
         >>> save_file_to_bucket(target_directory)
     """
 
-    client = storage.Client()
-    
     bucket_id = target_directory.split('/')[0]
     file_path = '/'.join(target_directory.split('/')[1:])
 
-    bucket = client.get_bucket(bucket_id)
+    # a bucket reference, without the extra get_bucket request
+    bucket = storage_client().bucket(bucket_id)
 
     # get blob
     blob = bucket.blob(file_path)
 
     # upload data
-    blob.upload_from_filename(source_directory)
+    blob.upload_from_filename(source_directory, timeout=http_timeout())
 
     return target_directory
 
@@ -182,15 +257,15 @@ def download_cloud_json(bucket_name: str, filename: str, **kwargs) -> Dict:
     Returns:
       The unpacked json data formatted to a dictionary.
     """
-    # initialize client
-    client = storage.Client(**kwargs)
+    # get the shared client, unless client kwargs are given
+    client = storage_client(**kwargs)
     # get bucket
-    bucket = client.get_bucket(bucket_name)
+    bucket = client.bucket(bucket_name)
     # get blob
     blob = bucket.blob(filename)
     # check if it exists
     # TODO: wrap this within a context
-    return json.loads(blob.download_as_string(client=None))
+    return json.loads(blob.download_as_bytes(timeout=http_timeout()))
 
 def cloud_file_exists(full_path: str, **kwargs) -> bool:
     """
@@ -206,11 +281,11 @@ def cloud_file_exists(full_path: str, **kwargs) -> bool:
     bucket_name = full_path.split('/')[0]
     remaining_path = '/'.join(full_path.split('/')[1:])
     
-    # initialize client
-    client = storage.Client(**kwargs)
+    # get the shared client, unless client kwargs are given
+    client = storage_client(**kwargs)
     # get bucket
-    bucket = client.get_bucket(bucket_name)
+    bucket = client.bucket(bucket_name)
     # get blob
     blob = bucket.blob(remaining_path)
     # check if it exists
-    return blob.exists()
\ No newline at end of file
+    return blob.exists(timeout=http_timeout())
\ No newline at end of file
@@ -0,0 +1,167 @@
+import functools
+import itertools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import psutil
+from loguru import logger
+
+FIELDS = ["calls", "wall", "cpu", "peak_rss", "bytes_read", "bytes_sent"]
+
+
+class RSSSampler:
+    """Sample the resident set size of this process in a background thread, while any stage is open.
+
+    Each open stage tracks the peak RSS sampled since it was opened, rather than the process's
+    lifetime high-water mark (ru_maxrss), which on a warm instance is that of the heaviest earlier run.
+
+    Args:
+        interval (float): seconds between samples
+    """
+
+    def __init__(self, interval: float = 0.05):
+
+        self.interval = interval
+        self._process = psutil.Process()
+        self._lock = threading.Lock()
+        self._keys = itertools.count()
+        self._peaks: Dict[int, int] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def rss(self) -> int:
+        return self._process.memory_info().rss
+
+    def open(self) -> int:
+        """Start tracking a stage, returning its key for `close`."""
+
+        current = self.rss()
+        with self._lock:
+            key = next(self._keys)
+            self._peaks[key] = current
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self._thread.start()
+        return key
+
+    def close(self, key: int) -> int:
+        """Stop tracking a stage, returning its peak RSS in bytes."""
+
+        current = self.rss()
+        with self._lock:
+            return max(self._peaks.pop(key), current)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            current = self.rss()
+            with self._lock:
+                if not self._peaks:
+                    # no open stages: stop, the next open starts a new thread
+                    self._thread = None
+                    return
+                for key, peak in self._peaks.items():
+                    self._peaks[key] = max(peak, current)
+
+
+class Metrics:
+    """Per-stage metrics of a run: calls, wall and cpu seconds, peak RSS, and bytes read and sent.
+
+    Wall and cpu time, bytes and calls add up over repeated stages; peak RSS is the maximum sampled
+    while the stage ran. CPU time and RSS are the process's, so stages running concurrently in
+    threads share them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages: Dict[str, Dict] = {}
+
+    def reset(self):
+        with self._lock:
+            self.stages = {}
+
+    def add(self, name: str, record: Dict):
+        with self._lock:
+            stage = self.stages.setdefault(name, {field: 0 for field in FIELDS})
+            for field in FIELDS:
+                if field == "peak_rss":
+                    stage[field] = max(stage[field], record.get(field, 0))
+                else:
+                    stage[field] += record.get(field, 0)
+
+    def merge(self, stages: Dict[str, Dict]):
+        """Add the stages of another run, e.g. from a worker process."""
+        for name, record in stages.items():
+            self.add(name, record)
+
+    def to_dict(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {name: dict(stage) for name, stage in self.stages.items()}
+
+    def log(self, **extra):
+        """Emit the metrics as one json line through loguru."""
+        logger.info("metrics " + json.dumps({**extra, "stages": self.to_dict()}))
+
+    def summary(self) -> str:
+        """A compact, one-line summary of the stages, e.g. for slack."""
+
+        parts = []
+        for name, stage in self.to_dict().items():
+            part = name
+            if stage["calls"]:
+                part += f" {stage['wall']:.1f}s"
+            if stage["bytes_read"]:
+                part += f" {stage['bytes_read'] / 2**20:.0f}MB read"
+            if stage["bytes_sent"]:
+                part += f" {stage['bytes_sent'] / 2**20:.1f}MB sent"
+            parts.append(part)
+        max_rss = max([stage["peak_rss"] for stage in self.stages.values()] or [0])
+
+        return ", ".join(parts) + f" | peak RSS {max_rss / 2**30:.1f}GB"
+
+
+METRICS = Metrics()
+RSS_SAMPLER = RSSSampler()
+
+
+def get_metrics() -> Metrics:
+    """The process-wide Metrics instance."""
+    return METRICS
+
+
+@contextmanager
+def stage(name: str, metrics: Optional[Metrics] = None):
+    """Time a pipeline stage and record it in `metrics` (default: the process-wide Metrics).
+
+    Yields a record dict, to which the stage can add 'bytes_read' and 'bytes_sent'.
+    """
+
+    metrics = metrics if metrics is not None else METRICS
+    record: Dict[str, float] = {"calls": 1, "bytes_read": 0, "bytes_sent": 0}
+
+    rss_key = RSS_SAMPLER.open()
+    wall_tic = time.perf_counter()
+    cpu_tic = time.process_time()
+    try:
+        yield record
+    finally:
+        record["wall"] = time.perf_counter() - wall_tic
+        record["cpu"] = time.process_time() - cpu_tic
+        record["peak_rss"] = RSS_SAMPLER.close(rss_key)
+        metrics.add(name, record)
+
+
+def timed(name: str):
+    """Decorate a function to record each call as the stage `name`."""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,295 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Dict, Optional
+
+
+def is_metadata_key(key: str) -> bool:
+    """zarr metadata keys (.zmetadata, .zarray, .zattrs, .zgroup) as opposed to chunk keys"""
+    return key.rsplit("/", 1)[-1].startswith(".")
+
+
+def array_prefix(key: str) -> str:
+    """The array path of a chunk or metadata key, e.g. 'precip' for 'precip/0.0.0', '' at the root"""
+    return key.rsplit("/", 1)[0] if "/" in key else ""
+
+
+def metadata_version(array_meta: dict) -> str:
+    """A hash of an array's .zarray metadata, which changes whenever the array is resized"""
+    return hashlib.sha1(json.dumps(array_meta, sort_keys=True).encode()).hexdigest()
+
+
+class CountingMapper(MutableMapping):
+    """Wrap a zarr store mapping and count the chunks and bytes read through it.
+
+    Args:
+        mapper (MutableMapping): any zarr-compatible store, e.g. an fsspec mapper
+    """
+
+    def __init__(self, mapper: MutableMapping):
+
+        self.mapper = mapper
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.chunks_read = 0
+            self.bytes_read = 0
+            self.metadata_read = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "chunks_read": self.chunks_read,
+                "bytes_read": self.bytes_read,
+                "metadata_read": self.metadata_read,
+            }
+
+    def __getitem__(self, key):
+
+        value = self.mapper[key]
+
+        with self._lock:
+            if is_metadata_key(key):
+                self.metadata_read += 1
+            else:
+                self.chunks_read += 1
+            self.bytes_read += len(value)
+
+        return value
+
+    def __setitem__(self, key, value):
+        self.mapper[key] = value
+
+    def __delitem__(self, key):
+        del self.mapper[key]
+
+    def __contains__(self, key):
+        return key in self.mapper
+
+    def __iter__(self):
+        return iter(self.mapper)
+
+    def __len__(self):
+        return len(self.mapper)
+
+
+class CachingMapper(MutableMapping):
+    """A read-through local disk cache in front of a zarr store mapping.
+
+    Values read from `mapper` are written to `cache_dir` and served from there until they expire
+    or are evicted. The cache is bounded to `max_bytes`, evicting least-recently-used keys first.
+    Metadata keys (including consolidated .zmetadata) get their own, usually shorter, `metadata_ttl`,
+    since archives that are appended to change their metadata and their trailing chunks.
+    Chunks are cached under a hash of their array's current .zarray metadata, as read through this
+    mapper, so once fresh metadata shows an array has grown, none of its old chunks are served again.
+
+    Args:
+        mapper (MutableMapping): any zarr-compatible store, e.g. an fsspec mapper
+        cache_dir (str): the local directory to cache values in
+        max_bytes (int): the size limit of the cache directory
+        ttl (float): seconds after which cached chunks are re-fetched, None to never expire
+        metadata_ttl (float): seconds after which cached metadata is re-fetched, None to never expire
+    """
+
+    def __init__(
+        self,
+        mapper: MutableMapping,
+        cache_dir: str,
+        max_bytes: int = 10 * 2**30,
+        ttl: Optional[float] = 6 * 3600,
+        metadata_ttl: Optional[float] = 600,
+    ):
+
+        self.mapper = mapper
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.metadata_ttl = metadata_ttl
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # array prefix -> metadata_version of its .zarray, as last read
+        self._versions: Dict[str, str] = {}
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # LRU index of fname -> size, seeded oldest-first from the files already on disk
+        entries = []
+        for fname in os.listdir(self.cache_dir):
+            if not fname.endswith(".tmp"):
+                stat = os.stat(os.path.join(self.cache_dir, fname))
+                entries.append((stat.st_mtime, fname, stat.st_size))
+        self._index: OrderedDict = OrderedDict(
+            (fname, size) for _, fname, size in sorted(entries)
+        )
+        self._size = sum(self._index.values())
+
+    def _fname(self, key: str) -> str:
+        if not is_metadata_key(key):
+            key = f"{key}@{self._version(key)}"
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def _version(self, key: str) -> str:
+        prefix = array_prefix(key)
+        with self._lock:
+            version = self._versions.get(prefix)
+        if version is None:
+            # no metadata read yet for this array, read (and note) its .zarray
+            try:
+                self["/".join(filter(None, [prefix, ".zarray"]))]
+            except KeyError:
+                pass
+            with self._lock:
+                version = self._versions.setdefault(prefix, "")
+        return version
+
+    def _note_metadata(self, key: str, value: bytes):
+        """Record the metadata versions of the arrays described by a .zarray or .zmetadata value"""
+
+        name = key.rsplit("/", 1)[-1]
+        if name not in (".zarray", ".zmetadata"):
+            return
+        try:
+            meta = json.loads(value)
+        except ValueError:
+            return
+
+        if name == ".zarray":
+            versions = {array_prefix(key): metadata_version(meta)}
+        else:
+            base = key[: -len(".zmetadata")]
+            versions = {
+                array_prefix(base + meta_key): metadata_version(array_meta)
+                for meta_key, array_meta in meta.get("metadata", {}).items()
+                if meta_key.rsplit("/", 1)[-1] == ".zarray"
+            }
+
+        with self._lock:
+            self._versions.update(versions)
+
+    def _expired(self, key: str, path: str) -> bool:
+        ttl = self.metadata_ttl if is_metadata_key(key) else self.ttl
+        if ttl is None:
+            return False
+        return time.time() - os.path.getmtime(path) > ttl
+
+    def _read_cached(self, key: str) -> Optional[bytes]:
+        fname = self._fname(key)
+        path = os.path.join(self.cache_dir, fname)
+        try:
+            if self._expired(key, path):
+                return None
+            with open(path, "rb") as f:
+                value = f.read()
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            if fname in self._index:
+                self._index.move_to_end(fname)
+        return value
+
+    def _write_cached(self, key: str, value: bytes):
+        fname = self._fname(key)
+        path = os.path.join(self.cache_dir, fname)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._size += len(value) - self._index.pop(fname, 0)
+            self._index[fname] = len(value)
+            self._evict()
+
+    def _evict(self):
+        # called with the lock held
+        while self._size > self.max_bytes and len(self._index) > 1:
+            fname, size = self._index.popitem(last=False)
+            try:
+                os.remove(os.path.join(self.cache_dir, fname))
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+    def _invalidate(self, key: str):
+        fname = self._fname(key)
+        with self._lock:
+            self._size -= self._index.pop(fname, 0)
+        try:
+            os.remove(os.path.join(self.cache_dir, fname))
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "cache_hits": self.hits,
+                "cache_misses": self.misses,
+                "cache_bytes": self._size,
+            }
+
+    def __getitem__(self, key):
+
+        value = self._read_cached(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+        else:
+            # KeyError for missing keys (e.g. empty chunks) propagates to zarr uncached
+            value = bytes(self.mapper[key])
+            with self._lock:
+                self.misses += 1
+            self._write_cached(key, value)
+
+        if is_metadata_key(key):
+            self._note_metadata(key, value)
+
+        return value
+
+    def __setitem__(self, key, value):
+        self.mapper[key] = value
+        self._invalidate(key)
+
+    def __delitem__(self, key):
+        del self.mapper[key]
+        self._invalidate(key)
+
+    def __contains__(self, key):
+        fname = self._fname(key)
+        with self._lock:
+            cached = fname in self._index
+        if cached:
+            try:
+                if not self._expired(key, os.path.join(self.cache_dir, fname)):
+                    return True
+            except FileNotFoundError:
+                pass
+        return key in self.mapper
+
+    def __iter__(self):
+        return iter(self.mapper)
+
+    def __len__(self):
+        return len(self.mapper)
+
+
+def mapper_stats(mapper: MutableMapping) -> Dict[str, int]:
+    """Collect the stats of a stack of wrapping mappers, e.g. a CachingMapper over a CountingMapper"""
+
+    stats: Dict[str, int] = {}
+    current: Optional[MutableMapping] = mapper
+    while current is not None:
+        if isinstance(current, (CountingMapper, CachingMapper)):
+            stats.update(current.stats())
+        current = getattr(current, "mapper", None)
+    return stats
@@ -0,0 +1,177 @@
+import hashlib
+import os
+import tempfile
+from typing import Optional, Tuple
+
+import numpy as np
+from fsspec.core import url_to_fs
+from loguru import logger
+from shapely import geometry
+
+
+class MaskCache:
+    """Persistent on-disk cache of geometry masks.
+
+    Masks are keyed by a hash of the grid coordinates, the original geometry WKB, the simplification
+    tolerance, the `weighted` flag and the mask engine, and stored as compressed `.npz` files holding
+    the mask array, bounds, extents and the simplification error (NaN if not simplified).
+    The cache directory is bounded to `max_bytes`, evicting least-recently-used masks first.
+    Optionally, masks are mirrored to a bucket (or any fsspec url) so that fresh instances start warm.
+
+    Args:
+        cache_dir (str): the local directory to store masks in
+        max_bytes (int): the size limit of the local cache directory
+        mirror_url (str): optional fsspec url (e.g. gs://bucket/path) to mirror masks to
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: int = 512 * 2**20,
+        mirror_url: Optional[str] = None,
+    ):
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.mirror_url = mirror_url
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        if mirror_url is not None:
+            self.mirror_fs, self.mirror_root = url_to_fs(mirror_url)
+        else:
+            self.mirror_fs, self.mirror_root = None, None
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def grid_key(lons: np.ndarray, lats: np.ndarray) -> str:
+        h = hashlib.sha1()
+        h.update(np.ascontiguousarray(lons, dtype=np.float64).tobytes())
+        h.update(np.ascontiguousarray(lats, dtype=np.float64).tobytes())
+        return h.hexdigest()
+
+    @staticmethod
+    def key(
+        grid_key: str,
+        geom: geometry,
+        weighted: bool = True,
+        engine: str = "vectorized",
+        tolerance: Optional[float] = None,
+    ) -> str:
+        h = hashlib.sha1()
+        h.update(grid_key.encode())
+        h.update(geom.wkb)
+        h.update(f"{weighted}-{engine}".encode())
+        if tolerance:
+            h.update(f"simplify-{float(tolerance)!r}".encode())
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def get(
+        self, key: str
+    ) -> Optional[Tuple[np.ndarray, tuple, tuple, Optional[float]]]:
+        """Get a (mask, bounds, extents, simplify_error) tuple from the cache, or None if it is missing."""
+
+        path = self._path(key)
+
+        if not os.path.exists(path) and self.mirror_fs is not None:
+            self._pull(key)
+
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+
+        try:
+            with np.load(path) as f:
+                mask = f["mask"]
+                bounds = tuple(int(el) for el in f["bounds"])
+                extents = tuple(float(el) for el in f["extents"])
+                simplify_error = (
+                    float(f["simplify_error"]) if "simplify_error" in f.files else np.nan
+                )
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Dropping unreadable cached mask {path}: {e}")
+            os.remove(path)
+            self.misses += 1
+            return None
+
+        # refresh access time for LRU eviction
+        os.utime(path)
+        self.hits += 1
+
+        return mask, bounds, extents, (None if np.isnan(simplify_error) else simplify_error)
+
+    def put(
+        self,
+        key: str,
+        mask: np.ndarray,
+        bounds: tuple,
+        extents: tuple,
+        simplify_error: Optional[float] = None,
+    ) -> str:
+        """Write a mask to the cache, mirror it, and evict old masks if over the size limit."""
+
+        path = self._path(key)
+
+        # write-and-rename so concurrent readers never see partial files
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".npz.tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(
+                f,
+                mask=mask,
+                bounds=np.array(bounds),
+                extents=np.array(extents),
+                simplify_error=np.nan if simplify_error is None else simplify_error,
+            )
+        os.replace(tmp_path, path)
+
+        if self.mirror_fs is not None:
+            self._push(key)
+
+        self.evict()
+
+        return path
+
+    def evict(self):
+        """Remove least-recently-used masks until the cache is within `max_bytes`."""
+
+        entries = []
+        for fname in os.listdir(self.cache_dir):
+            if fname.endswith(".npz"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, fname))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, fname))
+
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, fname in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, fname))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _pull(self, key: str):
+        remote = "/".join([self.mirror_root.rstrip("/"), key + ".npz"])
+        try:
+            if self.mirror_fs.exists(remote):
+                tmp_path = self._path(key) + ".tmp"
+                self.mirror_fs.get_file(remote, tmp_path)
+                os.replace(tmp_path, self._path(key))
+        except Exception as e:
+            logger.warning(f"Could not pull mask {key} from {self.mirror_url}: {e}")
+
+    def _push(self, key: str):
+        remote = "/".join([self.mirror_root.rstrip("/"), key + ".npz"])
+        try:
+            self.mirror_fs.put_file(self._path(key), remote)
+        except Exception as e:
+            logger.warning(f"Could not mirror mask {key} to {self.mirror_url}: {e}")
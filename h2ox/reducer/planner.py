@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def plan_time_windows(
+    max_date_df: pd.DataFrame,
+    end_dt: datetime,
+    max_extra_days: int = 31,
+) -> List[Tuple[datetime, List[str]]]:
+    """Group stale reservoirs into as few reductions as possible.
+
+    Reservoirs whose most recent date is before `end_dt` are sorted by that date. Each window
+    starts at the earliest date it holds, and a later reservoir joins the window as long as it
+    would reduce at most `max_extra_days` days it already has. A newly added reservoir with an
+    old date therefore gets its own window instead of dragging every other reservoir into a
+    multi-year backfill.
+
+    Args:
+        max_date_df (pd.DataFrame): 'reservoir' and 'date' columns, as from BQClient.get_most_recent_dates
+        end_dt (datetime): the most recent date available in the archive
+        max_extra_days (int): the most already-reduced days a reservoir may re-reduce by joining a window
+    Returns:
+        List[Tuple[datetime, List[str]]]: (start_dt, reservoirs) for each window
+    """
+
+    stale = max_date_df.loc[
+        max_date_df["date"] < np.datetime64(end_dt), ["reservoir", "date"]
+    ].sort_values("date")
+
+    windows: List[Tuple[datetime, List[str]]] = []
+    for reservoir, date in stale.itertuples(index=False):
+        if windows and date - windows[-1][0] <= timedelta(days=max_extra_days):
+            windows[-1][1].append(reservoir)
+        else:
+            windows.append((date, [reservoir]))
+
+    return windows
+
+
+def filter_new_rows(df: pd.DataFrame, start_dates: Dict[str, datetime]) -> pd.DataFrame:
+    """Keep only the rows on or after each reservoir's own start date.
+
+    Args:
+        df (pd.DataFrame): a reduced dataframe with 'reservoir' and YYYY-mm-dd 'date' columns
+        start_dates (Dict[str, datetime]): the start date of each reservoir
+    Returns:
+        pd.DataFrame: the filtered dataframe
+    """
+
+    start_strs = df["reservoir"].map(
+        {
+            reservoir: pd.Timestamp(date).strftime("%Y-%m-%d")
+            for reservoir, date in start_dates.items()
+        }
+    )
+
+    return df.loc[df["date"] >= start_strs].reset_index(drop=True)
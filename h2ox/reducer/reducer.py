@@ -1,12 +1,113 @@
-from typing import List, Dict
+import os
+import time
+from typing import List, Iterator, Optional, Tuple
 from datetime import datetime, timedelta
 
+import fsspec
+import numpy as np
 from gcsfs import GCSFileSystem
 import pandas as pd
 import geopandas as gpd
 import xarray as xr
+from loguru import logger
 
-from h2ox.reducer import XRReducer
+from h2ox.reducer import MultiGeometryReducer
+from h2ox.reducer.instrumentation import stage
+from h2ox.reducer.mappers import CachingMapper, CountingMapper, mapper_stats
+from h2ox.reducer.mask_cache import MaskCache
+
+
+def get_mask_cache(target_spec: dict) -> Optional[MaskCache]:
+    """Build a MaskCache from target_spec['mask_cache'] or the MASK_CACHE_DIR env variable"""
+
+    cache_spec = target_spec.get('mask_cache')
+    if cache_spec is None and os.environ.get("MASK_CACHE_DIR") is not None:
+        cache_spec = {
+            'dir': os.environ["MASK_CACHE_DIR"],
+            'mirror_url': os.environ.get("MASK_CACHE_MIRROR"),
+        }
+    if cache_spec is None:
+        return None
+
+    return MaskCache(
+        cache_dir=cache_spec['dir'],
+        max_bytes=int(cache_spec.get('max_bytes', 512 * 2**20)),
+        mirror_url=cache_spec.get('mirror_url'),
+    )
+
+
+def get_mapper(target_spec: dict):
+    """Map the zarr archive at target_spec['url'].
+
+    Urls with an explicit non-gcs protocol (e.g. file:// or memory://) are opened with fsspec,
+    with any target_spec['storage_options'], everything else with a requester-pays GCSFileSystem. Remote reads are counted, and optionally
+    cached locally via target_spec['chunk_cache'] or the CHUNK_CACHE_DIR env variable.
+
+    Returns:
+        MutableMapping: the mapper to open, see `mapper_stats` for its read stats
+    """
+
+    url = target_spec['url']
+    if "://" in url and fsspec.utils.get_protocol(url) not in ('gs', 'gcs'):
+        base_mapper = fsspec.get_mapper(url, **target_spec.get('storage_options', {}))
+    else:
+        base_mapper = GCSFileSystem(requester_pays=True).get_mapper(url)
+
+    counting_mapper = CountingMapper(base_mapper)
+
+    cache_spec = target_spec.get('chunk_cache')
+    if cache_spec is None and os.environ.get("CHUNK_CACHE_DIR") is not None:
+        cache_spec = {'dir': os.environ["CHUNK_CACHE_DIR"]}
+    if cache_spec is None:
+        return counting_mapper
+
+    return CachingMapper(
+        counting_mapper,
+        cache_dir=cache_spec['dir'],
+        max_bytes=int(cache_spec.get('max_bytes', 10 * 2**30)),
+        ttl=cache_spec.get('ttl', 6 * 3600),
+        metadata_ttl=cache_spec.get('metadata_ttl', 600),
+    )
+
+
+def open_archive(target_spec: dict):
+    """Open the zarr archive of a target spec.
+
+    Returns:
+        tuple: (zx_arr, mapper)
+    """
+
+    mapper = get_mapper(target_spec)
+
+    return xr.open_zarr(mapper), mapper
+
+
+def build_reducer(
+    target_spec: dict,
+    array: xr.Dataset,
+    gdf: gpd.GeoDataFrame,
+) -> MultiGeometryReducer:
+    """A MultiGeometryReducer over the variables of `array`, with the masks of `gdf` built.
+
+    Masks only depend on the grid, so the reducer can be reused for any time period of `array`,
+    see `reduce_timeperiod_to_blocks`.
+    """
+
+    # reduce all variables and all geometries together: each mask is built once,
+    # and all geometries are reduced with one sparse matmul over their union window
+    ds = MultiGeometryReducer(
+        array=array,
+        lat_variable=target_spec['lat_col'], 
+        lon_variable=target_spec['lon_col'],
+        mask_engine=target_spec.get('mask_engine', 'vectorized'),
+        mask_cache=get_mask_cache(target_spec),
+        simplify=target_spec.get('simplify'),
+    )
+
+    with stage('mask'):
+        ds.mask(gdf["geometry"])
+
+    return ds
 
 
 def reduce_timeperiod_to_df(
@@ -14,59 +115,223 @@ def reduce_timeperiod_to_df(
     end_dt: datetime, 
     target_spec: dict,  
     gdf: gpd.GeoDataFrame,
+    zx_arr: Optional[xr.Dataset] = None,
+    incremental: bool = False,
+    compute_kwargs: Optional[dict] = None,
+    reducer: Optional[MultiGeometryReducer] = None,
 ):
-    
-    # map the zxr
-    mapper = GCSFileSystem(requester_pays=True).get_mapper
-    zx_arr = xr.open_zarr(mapper(target_spec['url']))
-
-    # reduce the xarray object for each variable - geometry
-    reduced_var_arrays: Dict[str, xr.DataArray] = {}
-    for variable in target_spec['variables']:
-        reduced_geom_arrays = {}
-        ds = XRReducer(
-            array=zx_arr[variable],
-            lat_variable=target_spec['lat_col'], 
-            lon_variable=target_spec['lon_col'],
-        )
+    """Reduce the archive of `target_spec` over the geometries of `gdf` to a long-form dataframe.
 
-        # for each geometry in the gdf
-        for idx, row in gdf.iterrows():
-            reduced_geom_arrays[idx] = ds.reduce(
-                row["geometry"], start_dt, end_dt
+    Pass an already opened archive as `zx_arr` to reuse it across calls,
+    otherwise it is opened (and its read stats logged) for this call only.
+    `compute_kwargs` (e.g. from `dask_scheduler`) are passed to dask's compute.
+    Pass a `reducer` from `build_reducer` over the same archive and `gdf` to reuse its masks.
+
+    With `incremental`, meant for the few newest days of a daily update, the archive is first
+    indexed down to the time steps of start_dt:end_dt, and each window is read and reduced
+    eagerly with numpy instead of through a dask graph.
+    """
+
+    assert not (incremental and reducer is not None), "an incremental reduction builds its own reducer"
+
+    # map the zxr, counting the chunks and bytes read
+    mapper = None
+    if zx_arr is None and reducer is None:
+        zx_arr, mapper = open_archive(target_spec)
+
+    if reducer is None:
+        assert zx_arr is not None
+        array = zx_arr[target_spec['variables']]
+        if incremental:
+            start_idx, end_idx = time_index_range(array['time'].values, start_dt, end_dt)
+            time_chunks = array[target_spec['variables'][0]].chunksizes.get('time')
+            logger.info(
+                f"Reducing time steps {start_idx}:{end_idx} in time chunks {chunk_index_range(start_idx, end_idx, time_chunks)}"
             )
+            array = array.isel(time=slice(start_idx, end_idx))
 
-        reduced_var_arrays[variable] = xr.concat(
-            list(reduced_geom_arrays.values()),
-            pd.Index(list(reduced_geom_arrays.keys()), name="reservoir"),
+        reducer = build_reducer(target_spec, array, gdf)
+
+    # force daily time dimension, by default fused into the reduction
+    fused_daily = target_spec.get('fused_daily', True)
+
+    # building the graph (or, eagerly, reading and reducing) and computing it is one compute stage
+    tic = time.time()
+    with stage('compute'):
+        array = reducer.reduce(
+            gdf["geometry"], start_dt, end_dt, dim="reservoir", daily=fused_daily, eager=incremental,
+            compute_kwargs=compute_kwargs,
         )
-        reduced_var_arrays[variable].name = variable
+        logger.info(f"Reducing {len(gdf)} geometries over spatial chunks {reducer.planned_chunks()}")
 
-    # merge back along the variable dimension
-    array = xr.merge(list(reduced_var_arrays.values()))
+        if not fused_daily:
+            array = array.resample({"time": "1D"}).mean("time")
 
-    # force daily time dimension
-    array = array.resample({"time": "1D"}).mean("time")
-    
-    if 'step' in array.coords.keys():
-        array = array.resample({'step':timedelta(days=1)}).mean('step')
-    
-    # compute from dask
-    array = array.compute()
+            if 'step' in array.coords.keys():
+                array = array.resample({'step':timedelta(days=1)}).mean('step')
+
+        # compute from dask
+        array = array.compute(**(compute_kwargs or {}))
+    logger.info(f"Computed {dict(array.sizes)} in {time.time() - tic:.1f}s")
+    if reducer.simplify_errors:
+        logger.info(f"Simplified geometries with a max relative weight error of {max(reducer.simplify_errors.values()):.2e}")
+    if mapper is not None:
+        logger.info(f"Read from {target_spec['url']}: {mapper_stats(mapper)}")
 
     # cast to dataframe
-    df = array.to_dataframe()
+    with stage('assemble'):
+        return reduced_to_df(array, target_spec['variables'], target_spec['variables_rename'])
+
 
-    # add date and timestamp
-    df['date'] = df.reset_index()['time'].dt.date.values
-    df['date'] = df['date'].apply(lambda el: el.strftime("%Y-%m-%d"))
-    df['timestamp'] = datetime.now()
-    df['timestamp'] = df['timestamp'].dt.strftime("%Y-%m-%dT%H:%M:%S.%f")
+def reduced_to_df(
+    array: xr.Dataset,
+    variables: List[str],
+    variables_rename: List[str],
+) -> pd.DataFrame:
+    """Cast a computed (reservoir, time[, step]) dataset to a long-form dataframe, one row per reservoir and date.
 
-    df = df.rename(columns=dict(zip(target_spec['variables'], target_spec['variables_rename']))).reset_index().drop(columns=['time'])
-    
-    if 'step' in df.columns:
-        df = pd.concat([df.groupby(['reservoir','date','timestamp'])[variable].apply(list) for variable in target_spec['variables_rename']], axis=1)
-        df = df.reset_index()
+    Variables with a 'step' dimension become list-valued columns, one list element per step.
+    Rows are assembled straight from the numpy arrays, with no per-row python.
 
-    return df
\ No newline at end of file
+    Args:
+        array (xr.Dataset): the reduced and computed dataset
+        variables (List[str]): the dataset variables to cast
+        variables_rename (List[str]): the column name of each variable
+    Returns:
+        pd.DataFrame: 'reservoir', 'date' (YYYY-mm-dd), 'timestamp' and one column per variable
+    """
+
+    reservoirs = array['reservoir'].values
+    times = array['time'].values
+    n_reservoirs, n_times = reservoirs.shape[0], times.shape[0]
+
+    dates = np.datetime_as_string(times.astype('datetime64[D]'), unit='D')
+    timestamp = datetime.now().strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+    index_columns = {
+        'reservoir': np.repeat(reservoirs, n_times),
+        'date': np.tile(dates, n_reservoirs).astype(object),
+        'timestamp': np.full(n_reservoirs * n_times, timestamp, dtype=object),
+    }
+
+    data_columns = {}
+    has_step = False
+    for variable, rename in zip(variables, variables_rename):
+        variable_array = array[variable]
+        if 'step' in variable_array.dims:
+            has_step = True
+            values = variable_array.transpose('reservoir', 'time', 'step').values
+            data_columns[rename] = values.reshape(n_reservoirs * n_times, -1).tolist()
+        else:
+            values = variable_array.transpose('reservoir', 'time').values
+            data_columns[rename] = values.reshape(-1)
+
+    if has_step:
+        return pd.DataFrame({**index_columns, **data_columns})
+
+    return pd.DataFrame(
+        {'reservoir': index_columns['reservoir'], **data_columns, 'date': index_columns['date'], 'timestamp': index_columns['timestamp']}
+    )
+
+
+def time_index_range(times: np.ndarray, start_dt: datetime, end_dt: datetime) -> Tuple[int, int]:
+    """The [start, end) indices of the (sorted) `times` within start_dt:end_dt, both inclusive."""
+
+    start_idx = int(np.searchsorted(times, np.datetime64(pd.Timestamp(start_dt)), side='left'))
+    end_idx = int(np.searchsorted(times, np.datetime64(pd.Timestamp(end_dt)), side='right'))
+
+    return start_idx, max(start_idx, end_idx)
+
+
+def chunk_index_range(start_idx: int, end_idx: int, chunks: Optional[tuple] = None) -> Tuple[int, int]:
+    """The [first, last) chunks holding the indices start_idx:end_idx."""
+
+    if chunks is None:
+        return 0, 1
+
+    chunk_starts = np.cumsum((0,) + tuple(chunks))
+    first = int(np.searchsorted(chunk_starts, start_idx, side='right')) - 1
+    last = int(np.searchsorted(chunk_starts, max(start_idx, end_idx - 1), side='right'))
+
+    return first, last
+
+
+def time_blocks(
+    times: np.ndarray,
+    start_dt: datetime,
+    end_dt: datetime,
+    time_chunks: Optional[tuple] = None,
+    block_days: Optional[int] = None,
+) -> List[Tuple[pd.Timestamp, pd.Timestamp]]:
+    """Split start_dt:end_dt into consecutive, non-overlapping time blocks.
+
+    Blocks are `block_days` long if given, otherwise aligned to the archive's time chunks
+    (e.g. the four-year chunking of the archives), so each block reads whole chunks once.
+    Block edges are floored to days, so no day is split between two blocks. The period is
+    clipped to the extent of `times`, so no block is empty.
+
+    Args:
+        times (np.ndarray): the time coordinate of the archive
+        start_dt (datetime): the start of the period, inclusive
+        end_dt (datetime): the end of the period, inclusive
+        time_chunks (tuple): the chunk sizes along the time dimension of the archive
+        block_days (int): the length of each block in days, overrides `time_chunks`
+    Returns:
+        List[Tuple[pd.Timestamp, pd.Timestamp]]: the inclusive (start, end) of each block
+    """
+
+    start = max(pd.Timestamp(start_dt), pd.Timestamp(times[0]))
+    end = min(pd.Timestamp(end_dt), pd.Timestamp(times[-1]))
+    if start > end:
+        return []
+
+    if block_days is not None:
+        edges = pd.date_range(start.floor('D'), end, freq=f'{block_days}D')[1:]
+    elif time_chunks is not None:
+        chunk_starts = np.cumsum((0,) + tuple(time_chunks))[1:-1]
+        edges = pd.DatetimeIndex(times[chunk_starts]).floor('D')
+    else:
+        edges = pd.DatetimeIndex([])
+
+    edges = sorted(set(edge for edge in edges if start < edge <= end))
+    starts = [start] + edges
+    ends = [edge - pd.Timedelta(1, 'ns') for edge in edges] + [end]
+
+    return list(zip(starts, ends))
+
+
+def reduce_timeperiod_to_blocks(
+    start_dt: datetime,
+    end_dt: datetime,
+    target_spec: dict,
+    gdf: gpd.GeoDataFrame,
+    zx_arr: xr.Dataset,
+    block_days: Optional[int] = None,
+    compute_kwargs: Optional[dict] = None,
+) -> Iterator[pd.DataFrame]:
+    """Reduce start_dt:end_dt block by block, see `time_blocks`.
+
+    Each block is only reduced when the next dataframe is requested, so a caller pushing each
+    dataframe before requesting the next holds at most one block in memory, and a crash leaves
+    every block before it pushed.
+
+    Yields:
+        pd.DataFrame: the reduced dataframe of each block, as from `reduce_timeperiod_to_df`
+    """
+
+    blocks = time_blocks(
+        zx_arr['time'].values,
+        start_dt,
+        end_dt,
+        time_chunks=zx_arr[target_spec['variables'][0]].chunksizes.get('time'),
+        block_days=block_days,
+    )
+
+    # the masks only depend on the grid: build them once for all blocks
+    reducer = build_reducer(target_spec, zx_arr[target_spec['variables']], gdf) if blocks else None
+
+    for ii, (block_start, block_end) in enumerate(blocks):
+        logger.info(f"Reducing block {ii + 1}/{len(blocks)}: {block_start}-{block_end}")
+        yield reduce_timeperiod_to_df(
+            block_start, block_end, target_spec, gdf, compute_kwargs=compute_kwargs, reducer=reducer
+        )
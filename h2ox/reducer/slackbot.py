@@ -1,4 +1,4 @@
-import requests
+from h2ox.reducer.gcp_utils import http_session, http_timeout
 
 class SlackMessenger:
     def __init__(self,token,target, name):
@@ -15,6 +15,9 @@ class SlackMessenger:
                 'text': message
         }
         
-        r = requests.post(url='https://slack.com/api/chat.postMessage', data=data)
+        # the shared, pooled session: no new TLS handshake per message
+        r = http_session().post(
+            url='https://slack.com/api/chat.postMessage', data=data, timeout=http_timeout()
+        )
         
-        return r.status_code
\ No newline at end of file
+        return r.status_code
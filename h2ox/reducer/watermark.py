@@ -0,0 +1,117 @@
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, Optional, Union
+
+import pandas as pd
+from loguru import logger
+
+
+def _date_strs(dates: Dict) -> Dict[str, str]:
+    return {
+        str(reservoir): pd.Timestamp(date).strftime("%Y-%m-%d")
+        for reservoir, date in dates.items()
+    }
+
+
+class LocalWatermark:
+    """The most recent pushed date of each reservoir, per table, in a local json file.
+
+    Args:
+        path (str): the json file to keep the watermarks in
+    """
+
+    def __init__(self, path: str):
+
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self) -> Dict[str, Dict[str, str]]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable watermark file {self.path}: {e}")
+            return {}
+
+    def get(self, table_str: str) -> Dict[str, pd.Timestamp]:
+
+        with self._lock:
+            dates = self._read().get(table_str, {})
+
+        return {reservoir: pd.Timestamp(date) for reservoir, date in dates.items()}
+
+    def update(self, table_str: str, dates: Dict):
+        """Raise the watermarks of `dates`' reservoirs, never lowering them."""
+
+        with self._lock:
+            watermarks = self._read()
+            table = watermarks.setdefault(table_str, {})
+            for reservoir, date in _date_strs(dates).items():
+                table[reservoir] = max(table.get(reservoir, date), date)
+
+            dirname = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(dirname, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(watermarks, f)
+            os.replace(tmp_path, self.path)
+
+
+class TableWatermark:
+    """The most recent pushed date of each reservoir, per table, in a small BigQuery table.
+
+    The table has `table_str` (STRING), `reservoir` (STRING) and `date` (DATE) columns, and is only
+    appended to; the watermark is the greatest date of each reservoir.
+
+    Args:
+        client (bigquery.Client): a BigQuery client, or any stand-in with the same methods
+        table (str): the watermark table, e.g. 'project.dataset.watermarks'
+    """
+
+    def __init__(self, client, table: str):
+
+        self.client = client
+        self.table = table
+
+    def get(self, table_str: str) -> Dict[str, pd.Timestamp]:
+
+        Q = f"""
+            SELECT reservoir, MAX(date) AS date
+            FROM `{self.table}`
+            WHERE table_str = '{table_str}'
+            GROUP BY reservoir
+        """
+
+        df = self.client.query(Q).result().to_dataframe()
+
+        return {
+            reservoir: pd.Timestamp(date)
+            for reservoir, date in zip(df["reservoir"], df["date"])
+        }
+
+    def update(self, table_str: str, dates: Dict):
+
+        rows = [
+            {"table_str": table_str, "reservoir": reservoir, "date": date}
+            for reservoir, date in _date_strs(dates).items()
+        ]
+        if len(rows) == 0:
+            return
+
+        errors = self.client.insert_rows_json(self.table, rows)
+        if errors != []:
+            logger.warning(f"Could not update watermarks in {self.table}: {errors[:10]}")
+
+
+def get_watermark(client=None) -> Optional[Union[LocalWatermark, TableWatermark]]:
+    """A watermark from the WATERMARK_PATH (local json file) or WATERMARK_TABLE (BigQuery table) env variables, if set."""
+
+    if os.environ.get("WATERMARK_PATH") is not None:
+        return LocalWatermark(os.environ["WATERMARK_PATH"])
+    if os.environ.get("WATERMARK_TABLE") is not None and client is not None:
+        return TableWatermark(client, os.environ["WATERMARK_TABLE"])
+    return None
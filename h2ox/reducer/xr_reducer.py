@@ -1,30 +1,120 @@
+from typing import Dict, List, Optional, Tuple, Union
+
+import dask.array as da
 import numpy as np
+import pandas as pd
 import xarray as xr
+from scipy import sparse
 from shapely import geometry
 
-from h2ox.reducer.geoutils import get_mask
+from h2ox.reducer.geoutils import get_mask, grid_tolerance, simplify_geometry
+from h2ox.reducer.mask_cache import MaskCache
+
+
+def get_cached_mask(
+    lons: np.ndarray,
+    lats: np.ndarray,
+    geom: geometry,
+    weighted: bool = True,
+    engine: str = "vectorized",
+    mask_cache: Optional[MaskCache] = None,
+    grid_key: Optional[str] = None,
+    tolerance: Optional[float] = None,
+):
+    """get_mask, read-through `mask_cache` if one is given.
+
+    With a `tolerance`, the geometry is simplified before masking (see `simplify_geometry`). Masks
+    are cached by the original geometry and the tolerance, so a cache hit skips simplification too.
+
+    Returns:
+        tuple: (mask, bounds, extents, simplify_error), simplify_error None without a `tolerance`
+    """
+
+    cache_key: Optional[str] = None
+    if mask_cache is not None:
+        if grid_key is None:
+            grid_key = mask_cache.grid_key(lons, lats)
+        cache_key = mask_cache.key(grid_key, geom, weighted, engine, tolerance)
+
+        cached = mask_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    simplify_error = None
+    if tolerance:
+        geom, simplify_error = simplify_geometry(geom, tolerance)
+
+    mask, bounds, extents = get_mask(
+        lons=lons, lats=lats, geom=geom, weighted=weighted, engine=engine
+    )
+    if mask_cache is not None and cache_key is not None:
+        mask_cache.put(cache_key, mask, bounds, extents, simplify_error)
+
+    return mask, bounds, extents, simplify_error
 
 
 class XRReducer:
-    def __init__(self, array, lat_variable="latitude", lon_variable="longitude"):
+    """Reduce an xarray object over shapely geometries.
+
+    `array` may be an xr.DataArray or an xr.Dataset. With a Dataset, each geometry's mask is
+    built once and applied to all data variables in the same pass.
+
+    With `simplify`, geometries are simplified to that fraction of the grid spacing before masking
+    (see `simplify_geometry`), and the relative weight error bound is kept in `simplify_error`.
+    """
+
+    def __init__(
+        self,
+        array,
+        lat_variable="latitude",
+        lon_variable="longitude",
+        mask_engine="vectorized",
+        mask_cache: Optional[MaskCache] = None,
+        simplify: Optional[float] = None,
+    ):
 
         self.lat_variable = lat_variable
         self.lon_variable = lon_variable
+        self.mask_engine = mask_engine
+        self.mask_cache = mask_cache
+        self.simplify = simplify
+        self.simplify_error: Optional[float] = None
+        self._grid_key: Optional[str] = None
 
         self.array = array
         self.mask_geometry = None
-        self.mask_array = None
-        self.mask_bounds = None
-        self.weighted = None
+        self.mask_array: Optional[xr.DataArray] = None
+        self.mask_bounds: Optional[tuple] = None
+        self.mask_extents: Optional[tuple] = None
+        self.weighted: Optional[bool] = None
         self.mask_geom = None
 
-    def mask(self, geom: geometry, weighted: bool = True) -> np.ndarray:
+    def mask(
+        self, geom: geometry, weighted: bool = True, engine: Optional[str] = None
+    ) -> xr.DataArray:
+
+        if engine is None:
+            engine = self.mask_engine
+
+        lons = self.array[self.lon_variable].values
+        lats = self.array[self.lat_variable].values
 
-        mask, bounds, extents = get_mask(
-            lons=self.array[self.lon_variable].values,
-            lats=self.array[self.lat_variable].values,
+        if self.mask_cache is not None and self._grid_key is None:
+            self._grid_key = self.mask_cache.grid_key(lons, lats)
+
+        tolerance = None
+        if self.simplify:
+            tolerance = grid_tolerance(lons, lats, self.simplify)
+
+        mask, bounds, extents, self.simplify_error = get_cached_mask(
+            lons=lons,
+            lats=lats,
             geom=geom,
             weighted=weighted,
+            engine=engine,
+            mask_cache=self.mask_cache,
+            grid_key=self._grid_key,
+            tolerance=tolerance,
         )
 
         if (
@@ -60,6 +150,7 @@ class XRReducer:
 
         if self.mask_bounds is None:
             self.mask(geom=geom)
+        assert self.mask_bounds is not None
 
         return self.array.isel(
             {
@@ -84,21 +175,612 @@ class XRReducer:
             if not self.mask_geom.equals(geom):
                 self.mask(geom, weighted=weighted)
 
-        clipped_array = self.clip(geom)
+        clipped_array = self.clip(geom).sel(dict(time=slice(start_dt, end_dt)))
+        assert self.mask_array is not None
 
-        dims_order = ["time", self.lat_variable, self.lon_variable]
-        dims_order = dims_order + [
-            cc for cc in list(clipped_array.coords.keys()) if cc not in dims_order
-        ]
+        # contract lat/lon with the mask in one step, see reduce_variable
+        weights = sparse.csr_matrix(self.mask_array.values.reshape(1, -1))
 
-        reduced_array = (
-            clipped_array.sel(dict(time=slice(start_dt, end_dt)))
-            .where(clipped_array > 0)
-            .transpose(*dims_order)
-            * self.mask_array
-        ).sum(dim=(self.lat_variable, self.lon_variable))
+        def _reduce(array):
+            return (
+                reduce_variable(
+                    array, weights, [0], "geometry", self.lat_variable, self.lon_variable
+                )
+                .isel(geometry=0, drop=True)
+                .transpose("time", ...)
+            )
+
+        if isinstance(clipped_array, xr.Dataset):
+            reduced_array = xr.Dataset(
+                {
+                    name: _reduce(variable)
+                    for name, variable in clipped_array.data_vars.items()
+                }
+            )
+        else:
+            reduced_array = _reduce(clipped_array)
 
         if op == "mean":
             return reduced_array / self.mask_array.sum()
         elif op == "sum":
             return reduced_array
+
+
+# bound on the temporary holding the positive-filtered values of one slab of rows
+SLAB_BYTES = 32 * 2**20
+
+
+def kernel_dtype(dtype) -> np.dtype:
+    """The reduction dtype: float32 for float32 sources, float64 otherwise."""
+    return np.dtype(np.float32) if np.dtype(dtype) == np.float32 else np.dtype(np.float64)
+
+
+def _reduce_block(block: np.ndarray, weights: sparse.csr_matrix) -> np.ndarray:
+    """Contract the trailing (lat, lon) axes of a block with a (n_geoms x n_cells) weight matrix.
+
+    Non-positive and NaN values are treated as zero, matching XRReducer. The filtering is done
+    slab by slab into one reused buffer with np.fmax (which returns 0 for NaN), so no full-size
+    masked copy of the block is allocated.
+    """
+
+    dtype = kernel_dtype(block.dtype)
+    weights = weights.astype(dtype, copy=False)
+
+    lead_shape = block.shape[:-2]
+    n_cells = block.shape[-2] * block.shape[-1]
+    values = block.reshape(-1, n_cells)
+    n_rows = values.shape[0]
+
+    reduced = np.empty((n_rows, weights.shape[0]), dtype=dtype)
+    slab = max(1, min(n_rows, SLAB_BYTES // max(1, n_cells * dtype.itemsize)))
+    buffer = np.empty((slab, n_cells), dtype=dtype)
+
+    for start in range(0, n_rows, slab):
+        stop = min(start + slab, n_rows)
+        positive = np.fmax(values[start:stop], 0, out=buffer[: stop - start])
+        reduced[start:stop] = weights.dot(positive.T).T
+
+    return reduced.reshape(lead_shape + (weights.shape[0],))
+
+
+def _bin_mean(values: np.ndarray, bins: np.ndarray, n_bins: int, axis: int) -> np.ndarray:
+    """Mean of `values` along `axis` within integer `bins`, as a (n_bins x n) binning-matrix product. Empty bins are NaN."""
+
+    binning = np.zeros((n_bins, bins.shape[0]), dtype=values.dtype)
+    binning[bins, np.arange(bins.shape[0])] = 1
+    counts = binning.sum(axis=1)
+
+    binned = np.tensordot(binning, np.moveaxis(values, axis, 0), axes=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        binned = binned / counts.reshape((-1,) + (1,) * (binned.ndim - 1))
+
+    return np.moveaxis(binned, 0, axis)
+
+
+def _reduce_block_daily(
+    block: np.ndarray,
+    weights: sparse.csr_matrix,
+    days: np.ndarray,
+    time_axis: int,
+    step_bins: Optional[np.ndarray] = None,
+    n_step_bins: Optional[int] = None,
+    step_axis: Optional[int] = None,
+    block_info=None,
+) -> np.ndarray:
+    """_reduce_block, followed by daily means along time (and step) within the block.
+
+    `days` holds the integer day of every time step of the whole array. Blocks must start on a
+    day edge, and output the days from their first day up to the next block's first day.
+    """
+
+    if block_info is not None:
+        start, stop = block_info[0]["array-location"][time_axis]
+        n_days = block_info[None]["chunk-shape"][time_axis]
+    else:
+        start, stop = 0, days.shape[0]
+        n_days = days[-1] - days[0] + 1
+
+    reduced = _reduce_block(block, weights)
+    reduced = _bin_mean(reduced, days[start:stop] - days[start], n_days, time_axis)
+
+    if step_axis is not None:
+        assert step_bins is not None and n_step_bins is not None
+        reduced = _bin_mean(reduced, step_bins, n_step_bins, step_axis)
+
+    return reduced
+
+
+def _day_chunks(days: np.ndarray, time_chunks: tuple) -> Tuple[tuple, tuple]:
+    """Move time chunk edges forward onto day edges.
+
+    Returns:
+        tuple: (time_chunks, day_chunks), the aligned input chunks and the days each one outputs
+    """
+
+    day_starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    edges = sorted(
+        set(
+            int(day_starts[idx])
+            for idx in np.searchsorted(day_starts, np.cumsum(time_chunks)[:-1])
+            if idx < day_starts.shape[0]
+        )
+        - {0}
+    )
+
+    starts = [0] + edges
+    stops = edges + [days.shape[0]]
+
+    new_time_chunks = tuple(stop - start for start, stop in zip(starts, stops))
+    day_chunks = tuple(int(days[stop] - days[start]) for start, stop in zip(starts[:-1], stops[:-1])) + (
+        int(days[-1] - days[starts[-1]] + 1),
+    )
+
+    return new_time_chunks, day_chunks
+
+
+def _chunk_range(start: int, stop: int, chunks: Optional[tuple]) -> tuple:
+    # inclusive range of storage chunk indices covering [start, stop)
+    if chunks is None:
+        return start, stop - 1
+    edges = np.cumsum((0,) + tuple(chunks))
+    return (
+        int(np.searchsorted(edges, start, side="right") - 1),
+        int(np.searchsorted(edges, stop - 1, side="right") - 1),
+    )
+
+
+def _window_chunks(window: tuple, lon_chunks=None, lat_chunks=None) -> tuple:
+    return _chunk_range(window[0], window[2], lon_chunks) + _chunk_range(
+        window[1], window[3], lat_chunks
+    )
+
+
+def count_window_chunks(windows: List[tuple], lon_chunks=None, lat_chunks=None) -> int:
+    """Count the lat/lon storage chunks touched by a list of index windows, per time chunk"""
+    total = 0
+    for window in windows:
+        lon0, lon1, lat0, lat1 = _window_chunks(window, lon_chunks, lat_chunks)
+        total += (lon1 - lon0 + 1) * (lat1 - lat0 + 1)
+    return total
+
+
+def merge_windows(
+    windows: List[tuple], lon_chunks=None, lat_chunks=None
+) -> List[List[int]]:
+    """Group (lower_lon_idx, lower_lat_idx, upper_lon_idx, upper_lat_idx) windows that share a storage chunk.
+
+    Windows sharing a chunk are merged into their union bounding window (repeatedly, until no
+    merged windows share a chunk), so every chunk is read by exactly one window. Windows with
+    disjoint chunks are kept apart, so distant geometries do not read the space in between.
+
+    Returns:
+        List[List[int]]: the indices of the windows in each group
+    """
+
+    groups = [([ii], tuple(window)) for ii, window in enumerate(windows)]
+
+    merged = True
+    while merged:
+        merged = False
+        for aa in range(len(groups)):
+            lon0_a, lon1_a, lat0_a, lat1_a = _window_chunks(
+                groups[aa][1], lon_chunks, lat_chunks
+            )
+            for bb in range(aa + 1, len(groups)):
+                lon0_b, lon1_b, lat0_b, lat1_b = _window_chunks(
+                    groups[bb][1], lon_chunks, lat_chunks
+                )
+                if (
+                    lon0_a <= lon1_b
+                    and lon0_b <= lon1_a
+                    and lat0_a <= lat1_b
+                    and lat0_b <= lat1_a
+                ):
+                    window_a, window_b = groups[aa][1], groups[bb][1]
+                    groups[aa] = (
+                        groups[aa][0] + groups[bb][0],
+                        (
+                            min(window_a[0], window_b[0]),
+                            min(window_a[1], window_b[1]),
+                            max(window_a[2], window_b[2]),
+                            max(window_a[3], window_b[3]),
+                        ),
+                    )
+                    del groups[bb]
+                    merged = True
+                    break
+            if merged:
+                break
+
+    return [sorted(idx) for idx, _ in groups]
+
+
+def reduce_variable(
+    array: xr.DataArray,
+    weights: sparse.csr_matrix,
+    names: List,
+    dim: str,
+    lat_variable: str = "latitude",
+    lon_variable: str = "longitude",
+    daily: bool = False,
+) -> xr.DataArray:
+    """Contract the lat/lon dims of `array` with stacked (n_geoms x n_cells) weights.
+
+    Dask arrays are reduced chunk-wise with map_blocks, numpy arrays directly.
+    With `daily`, the output is also averaged to daily time (and step) values.
+
+    Returns:
+        xr.DataArray: the weighted sums, with dims (dim, *other dims of array)
+    """
+
+    lead_dims = [
+        dd for dd in array.dims if dd not in (lat_variable, lon_variable)
+    ]
+    data = array.transpose(*lead_dims, lat_variable, lon_variable).data
+    n_geoms = weights.shape[0]
+
+    coords = {
+        name: coord
+        for name, coord in array.coords.items()
+        if set(coord.dims) <= set(lead_dims)
+    }
+    coords[dim] = names
+
+    if not daily:
+        if isinstance(data, da.Array):
+            # the window is contracted in one go, so it must be a single chunk in lat/lon
+            data = data.rechunk({data.ndim - 2: -1, data.ndim - 1: -1})
+            reduced = data.map_blocks(
+                _reduce_block,
+                weights=weights,
+                drop_axis=[data.ndim - 2, data.ndim - 1],
+                new_axis=[data.ndim - 2],
+                chunks=data.chunks[:-2] + ((n_geoms,),),
+                dtype=kernel_dtype(data.dtype),
+            )
+        else:
+            reduced = _reduce_block(np.asarray(data), weights)
+
+        return xr.DataArray(
+            reduced, dims=lead_dims + [dim], coords=coords, name=array.name
+        ).transpose(dim, *lead_dims)
+
+    # daily means along time (and step) are folded into the contraction as binning matrices,
+    # matching .resample(time='1D').mean() and .resample(step=timedelta(days=1)).mean()
+    times = array["time"].values
+    days = times.astype("datetime64[D]").astype(np.int64)
+    time_axis = lead_dims.index("time")
+    day_coord = np.arange(days[0], days[-1] + 1).astype("datetime64[D]").astype(times.dtype)
+
+    daily_kwargs = dict(weights=weights, days=days, time_axis=time_axis)
+    daily_coords = {"time": day_coord}
+    if "step" in lead_dims:
+        steps = array["step"].values
+        one_day = np.timedelta64(1, "D").astype(steps.dtype)
+        step_bins = ((steps - steps[0]) // one_day).astype(np.int64)
+        n_step_bins = int(step_bins[-1] + 1)
+        daily_kwargs.update(
+            step_bins=step_bins,
+            n_step_bins=n_step_bins,
+            step_axis=lead_dims.index("step"),
+        )
+        daily_coords["step"] = steps[0] + one_day * np.arange(n_step_bins)
+
+    if isinstance(data, da.Array):
+        # single chunk in lat/lon (and step), and time chunks aligned to days
+        time_chunks, day_chunks = _day_chunks(days, data.chunks[time_axis])
+        rechunk = {data.ndim - 2: -1, data.ndim - 1: -1, time_axis: time_chunks}
+        out_chunks = list(data.chunks[:-2])
+        out_chunks[time_axis] = day_chunks
+        if "step" in lead_dims:
+            rechunk[daily_kwargs["step_axis"]] = -1
+            out_chunks[daily_kwargs["step_axis"]] = (daily_kwargs["n_step_bins"],)
+        data = data.rechunk(rechunk)
+
+        reduced = data.map_blocks(
+            _reduce_block_daily,
+            **daily_kwargs,
+            drop_axis=[data.ndim - 2, data.ndim - 1],
+            new_axis=[data.ndim - 2],
+            chunks=tuple(out_chunks) + ((n_geoms,),),
+            dtype=kernel_dtype(data.dtype),
+        )
+    else:
+        reduced = _reduce_block_daily(np.asarray(data), **daily_kwargs)
+
+    coords = {
+        name: coord
+        for name, coord in coords.items()
+        if not set(getattr(coord, "dims", ())) & set(daily_coords)
+    }
+    coords.update(daily_coords)
+
+    return xr.DataArray(
+        reduced, dims=lead_dims + [dim], coords=coords, name=array.name
+    ).transpose(dim, *lead_dims)
+
+
+class MultiGeometryReducer:
+    """Reduce an xarray object over many shapely geometries at once.
+
+    The weights of all geometries are stacked into sparse (n_geoms x n_cells) matrices over the
+    bounding windows of the geometries, where windows sharing a storage chunk are merged
+    (see `merge_windows`). Each merged window is read once and reduced for all of its geometries
+    with a single chunk-wise matmul over the flattened lat/lon axes, instead of one
+    clip-where-multiply-sum graph per geometry.
+
+    `array` may be an xr.DataArray or an xr.Dataset. With `simplify`, geometries are simplified to
+    that fraction of the grid spacing before masking, and the relative weight error bound of each
+    geometry is kept in `simplify_errors`.
+    """
+
+    def __init__(
+        self,
+        array,
+        lat_variable="latitude",
+        lon_variable="longitude",
+        mask_engine="vectorized",
+        mask_cache: Optional[MaskCache] = None,
+        simplify: Optional[float] = None,
+    ):
+
+        self.lat_variable = lat_variable
+        self.lon_variable = lon_variable
+        self.mask_engine = mask_engine
+        self.mask_cache = mask_cache
+        self.simplify = simplify
+        self.simplify_errors: Optional[Dict] = None
+
+        self.array = array
+        self.names: Optional[List] = None
+        self.geoms: Optional[List[geometry.base.BaseGeometry]] = None
+        self.windows: Optional[List[tuple]] = None
+        self.window_idx: Optional[List[List[int]]] = None
+        self.weights: Optional[List[sparse.csr_matrix]] = None
+        self.weight_sums: Optional[np.ndarray] = None
+        self.geom_windows: Optional[List[tuple]] = None
+        self.weighted: Optional[bool] = None
+
+    def _spatial_chunks(self):
+        try:
+            chunksizes = self.array.chunksizes
+        except ValueError:
+            # inconsistent chunks between dataset variables
+            return None, None
+        return chunksizes.get(self.lon_variable), chunksizes.get(self.lat_variable)
+
+    def mask(
+        self,
+        geoms: Union[Dict, pd.Series],
+        weighted: bool = True,
+        engine: Optional[str] = None,
+    ) -> List[sparse.csr_matrix]:
+        """Build the stacked weight matrices for a mapping of name -> geometry.
+
+        Returns:
+            List[sparse.csr_matrix]: (n_window_geoms, n_window_lats * n_window_lons) weights per merged window
+        """
+
+        if engine is None:
+            engine = self.mask_engine
+
+        lons = self.array[self.lon_variable].values
+        lats = self.array[self.lat_variable].values
+
+        grid_key = None
+        if self.mask_cache is not None:
+            grid_key = self.mask_cache.grid_key(lons, lats)
+
+        names = list(geoms.keys())
+
+        tolerance = None
+        if self.simplify:
+            tolerance = grid_tolerance(lons, lats, self.simplify)
+
+        masks = [
+            get_cached_mask(
+                lons=lons,
+                lats=lats,
+                geom=geoms[name],
+                weighted=weighted,
+                engine=engine,
+                mask_cache=self.mask_cache,
+                grid_key=grid_key,
+                tolerance=tolerance,
+            )
+            for name in names
+        ]
+
+        if self.simplify:
+            self.simplify_errors = {
+                name: error for name, (_, _, _, error) in zip(names, masks)
+            }
+
+        geom_windows = [bounds for _, bounds, _, _ in masks]
+        lon_chunks, lat_chunks = self._spatial_chunks()
+        window_idx = merge_windows(geom_windows, lon_chunks, lat_chunks)
+
+        windows, weights = [], []
+        for idx in window_idx:
+            # union window (lower_lon_idx, lower_lat_idx, upper_lon_idx, upper_lat_idx)
+            window = (
+                min(geom_windows[ii][0] for ii in idx),
+                min(geom_windows[ii][1] for ii in idx),
+                max(geom_windows[ii][2] for ii in idx),
+                max(geom_windows[ii][3] for ii in idx),
+            )
+            n_window_lons = window[2] - window[0]
+            n_window_lats = window[3] - window[1]
+
+            rows, cols, vals = [], [], []
+            for row, ii in enumerate(idx):
+                mask, bounds, _, _ = masks[ii]
+                lat_idx, lon_idx = np.nonzero(mask)
+                rows.append(np.full(lat_idx.shape, row))
+                cols.append(
+                    (lat_idx + bounds[1] - window[1]) * n_window_lons
+                    + (lon_idx + bounds[0] - window[0])
+                )
+                vals.append(mask[lat_idx, lon_idx])
+
+            windows.append(window)
+            weights.append(
+                sparse.csr_matrix(
+                    (
+                        np.concatenate(vals),
+                        (np.concatenate(rows), np.concatenate(cols)),
+                    ),
+                    shape=(len(idx), n_window_lats * n_window_lons),
+                )
+            )
+
+        self.names = names
+        self.geoms = [geoms[name] for name in names]
+        self.geom_windows = geom_windows
+        self.windows = windows
+        self.window_idx = window_idx
+        self.weights = weights
+        self.weight_sums = np.array([mask.sum() for mask, _, _, _ in masks])
+        self.weighted = weighted
+
+        return self.weights
+
+    def planned_chunks(self) -> Dict[str, int]:
+        """Spatial storage chunks read per time chunk: with merged windows vs. one window per geometry"""
+
+        assert self.windows is not None and self.geom_windows is not None, "call mask() first"
+
+        lon_chunks, lat_chunks = self._spatial_chunks()
+        return {
+            "windows": len(self.windows),
+            "merged": count_window_chunks(self.windows, lon_chunks, lat_chunks),
+            "per_geometry": count_window_chunks(
+                self.geom_windows, lon_chunks, lat_chunks
+            ),
+        }
+
+    def clip(self, window: tuple):
+
+        return self.array.isel(
+            {
+                self.lon_variable: slice(window[0], window[2]),
+                self.lat_variable: slice(window[1], window[3]),
+            }
+        )
+
+    def _reduce_window(
+        self,
+        ii: int,
+        start_dt,
+        end_dt,
+        dim: str,
+        daily: bool = False,
+        eager: bool = False,
+        compute_kwargs: Optional[dict] = None,
+    ):
+
+        assert (
+            self.windows is not None
+            and self.names is not None
+            and self.window_idx is not None
+            and self.weights is not None
+        ), "call mask() first"
+
+        clipped_array = self.clip(self.windows[ii]).sel(
+            dict(time=slice(start_dt, end_dt))
+        )
+        if eager:
+            # read the window into memory and reduce it with numpy, without a dask graph
+            clipped_array = clipped_array.load(**(compute_kwargs or {}))
+        names = [self.names[jj] for jj in self.window_idx[ii]]
+
+        if isinstance(clipped_array, xr.Dataset):
+            return xr.Dataset(
+                {
+                    name: reduce_variable(
+                        variable,
+                        self.weights[ii],
+                        names,
+                        dim,
+                        self.lat_variable,
+                        self.lon_variable,
+                        daily=daily,
+                    )
+                    for name, variable in clipped_array.data_vars.items()
+                }
+            )
+        return reduce_variable(
+            clipped_array,
+            self.weights[ii],
+            names,
+            dim,
+            self.lat_variable,
+            self.lon_variable,
+            daily=daily,
+        )
+
+    def reduce(
+        self,
+        geoms: Union[Dict, pd.Series],
+        start_dt,
+        end_dt,
+        op="mean",
+        weighted=True,
+        dim="reservoir",
+        daily=False,
+        eager=False,
+        compute_kwargs=None,
+    ):
+        """Reduce all geometries over the period start_dt:end_dt.
+
+        With `daily`, the output is also averaged to daily values along time (and step, if present),
+        in the same pass as the spatial contraction. This matches resampling the output with
+        .resample(time='1D').mean() and .resample(step=timedelta(days=1)).mean(), with a smaller graph.
+
+        With `eager`, each window is read into memory and reduced with numpy right away, which
+        avoids dask overhead for short periods, e.g. the few newest days of a daily update.
+        `compute_kwargs` (e.g. scheduler=...) are passed to the eager reads.
+
+        Returns:
+            xr.DataArray or xr.Dataset: the reduced array with a new leading dimension `dim`
+        """
+
+        assert op in ["mean", "sum"], "'op' must be one of ['mean','sum']"
+        assert (
+            "time" in self.array.coords.keys()
+        ), "'time' variable must be in coordinates"
+
+        if (
+            self.weights is None
+            or self.geoms is None
+            or self.weighted != weighted
+            or list(geoms.keys()) != self.names
+            or not all(
+                geom.equals(geoms[name]) for name, geom in zip(self.names, self.geoms)
+            )
+        ):
+            self.mask(geoms, weighted=weighted)
+        assert self.windows is not None and self.names is not None
+
+        reduced_windows = [
+            self._reduce_window(
+                ii, start_dt, end_dt, dim, daily=daily, eager=eager, compute_kwargs=compute_kwargs
+            )
+            for ii in range(len(self.windows))
+        ]
+
+        if len(reduced_windows) == 1:
+            reduced_array = reduced_windows[0]
+        else:
+            reduced_array = xr.concat(reduced_windows, dim=dim)
+        reduced_array = reduced_array.sel({dim: self.names})
+
+        if op == "mean":
+            weight_sum = xr.DataArray(
+                self.weight_sums,
+                dims=(dim,),
+                coords={dim: self.names},
+            )
+            return reduced_array / weight_sum
+        elif op == "sum":
+            return reduced_array
@@ -2,20 +2,28 @@
 
 import json
 import logging
+import multiprocessing
 import os
 import sys
 import time
 import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import List, Optional, Tuple
 
 from flask import Flask, request
 from loguru import logger
-import numpy as np
 
 from h2ox.reducer import XRReducer, BQClient, reduce_timeperiod_to_df
+from h2ox.reducer.reducer import open_archive, reduce_timeperiod_to_blocks
+from h2ox.reducer.planner import plan_time_windows, filter_new_rows
+from h2ox.reducer.mappers import mapper_stats
+from h2ox.reducer.dask_config import dask_scheduler, get_dask_spec
+from h2ox.reducer.catalog import get_catalog
+from h2ox.reducer.instrumentation import get_metrics, stage, timed
 from h2ox.reducer.slackbot import SlackMessenger
-from h2ox.reducer.gcp_utils import download_blob_to_filename, upload_blob, create_task, deploy_task
+from h2ox.reducer.gcp_utils import upload_blob, create_task, deploy_task
+from h2ox.reducer.backends import get_token_store, get_warehouse, read_token_dates
 
 logger.remove()
 logger.add(sys.stdout, colorize=False, format="{time:YYYYMMDDHHmmss}|{level}| {message}")
@@ -123,7 +131,8 @@ def main_loop(
     tigge_token_path: Optional[str] = None,
     chirps_token_path: Optional[str] = None,
     target_spec: Optional[dict] = None,
-    requeue: Optional[bool] = False
+    requeue: Optional[bool] = False,
+    parallel: Optional[str] = None,
 ):
 
     # 1. get variables from environment or args
@@ -135,70 +144,94 @@ def main_loop(
         target_spec = json.loads(os.environ.get("TARGET_SPEC"))
     if requeue is None:
         requeue  = os.environ.get("REQUEUE")=="true"
+    if parallel is None:
+        parallel = os.environ.get("PARALLEL_SOURCES") or None
+    assert parallel in [None, 'thread', 'process'], "'parallel' must be one of [None, 'thread', 'process']"
         
-    
+    metrics = get_metrics()
+    metrics.reset()
+
+    # the warehouse (BigQuery or local Parquet) and token storage (GCS or local) backends
+    warehouse_spec = target_spec.get('warehouse')
+    client = get_warehouse(warehouse_spec)
+    token_store = get_token_store(target_spec.get('tokens'))
         
-    # 2. get tokens from storage
+    # 2. get tokens from storage, and
+    # 4. get all geometries, concurrently
     logger.info('Downloading tokens')
-    tigge_token_local_path = os.path.join(os.getcwd(),'tigge_token.json')
-    chirps_token_local_path = os.path.join(os.getcwd(),'chirps_token.json')
     
-    download_blob_to_filename(tigge_token_path, tigge_token_local_path)
-    download_blob_to_filename(chirps_token_path, chirps_token_local_path)
-    
-    # 3. get max-date from tokens
-    tigge_token = json.load(open(tigge_token_local_path,'r'))
-    chirps_token = json.load(open(chirps_token_local_path,'r'))
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # 3. get max-date from tokens, read concurrently and cached by generation
+        dates_future = executor.submit(
+            timed('download_tokens')(read_token_dates), token_store, tigge_token_path, chirps_token_path
+        )
+        catalog = get_catalog(client)
+        gdf_future = executor.submit(
+            timed('reservoir_gdf')(catalog.load if catalog is not None else client.get_reservoir_gdf)
+        )
+        tigge_dt, chirps_dt = dates_future.result()
+        gdf = gdf_future.result()
     
-    tigge_dt = datetime.strptime(tigge_token['most_recent_tigge'],'%Y-%m-%d') - timedelta(days=1)
-    chirps_dt = datetime.strptime(chirps_token['last_prelim'],'%Y-%m-%d') 
     logger.info(f'Got most recent datetimes: tigge: {tigge_dt}, chirps: {chirps_dt}')
     
-    # 4. get all geometries
-    client = BQClient()
-    
-    gdf = client.get_reservoir_gdf()
-    
-    # 5. get max-dates from BQ
-    
-    max_date_df = client.get_most_recent_dates('forecast_data')
-
+    # 5. get max-dates from BQ, and
     # 6. if archive dates > max-dates from BQ run reduction and upload
-    # 6a. Tigge:
-    forecast_rows = 0
-    for unq_dt in max_date_df['date'].unique():
-        if unq_dt< np.datetime64(tigge_dt):
-            
-            sites = max_date_df.loc[max_date_df['date']==unq_dt,'reservoir'].values
-            logger.info(f'Doing Tigge {unq_dt}-{tigge_dt} with {len(sites)} sites')
-            df = reduce_timeperiod_to_df(unq_dt, tigge_dt, target_spec['tigge'], gdf.loc[sites,:])
-            # upload reduction
-            client.push_data(table_str='forecast_data', df=df)
-            forecast_rows += len(df)
-          
-    # 6b. chirps:
-    max_date_df = client.get_most_recent_dates('precip_data')
-    precip_rows = 0
-    for unq_dt in max_date_df['date'].unique():
-        # 6b. chirps:
-        if unq_dt< np.datetime64(chirps_dt):
-            
-            sites = max_date_df.loc[max_date_df['date']==unq_dt,'reservoir'].values
-            logger.info(f'Doing CHIRPS {unq_dt}-{chirps_dt} with {len(sites)} sites')
-            df = reduce_timeperiod_to_df(unq_dt, chirps_dt, target_spec['chirps'], gdf.loc[sites,:])
-            # upload reduction
-            client.push_data(table_str='precip_data', df=df)
-            precip_rows += len(df)
+    # 6a. Tigge, and 6b. chirps
+    sources = [
+        ('Tigge', 'forecast_data', tigge_dt, target_spec['tigge']),
+        ('CHIRPS', 'precip_data', chirps_dt, target_spec['chirps']),
+    ]
     
+    if parallel is None:
+        results = [run_source(*source, gdf, client) for source in sources]
+    else:
+        # the sources are independent: different archives, tables, and tokens
+        # processes build their own warehouse client, which can't be pickled, and are spawned
+        # rather than forked, since forking after dask has started threads can deadlock
+        logger.info(f'Running sources in parallel with a {parallel} pool')
+        if parallel == 'thread':
+            executor = ThreadPoolExecutor(max_workers=len(sources))
+        else:
+            executor = ProcessPoolExecutor(
+                max_workers=len(sources), mp_context=multiprocessing.get_context('spawn')
+            )
+        with executor:
+            futures = [
+                executor.submit(run_source, *source, gdf, client)
+                if parallel == 'thread'
+                else executor.submit(run_source_with_metrics, *source, gdf, warehouse_spec=warehouse_spec)
+                for source in sources
+            ]
+            results = [future.result() for future in futures]
+
+        if parallel == 'process':
+            # merge the metrics recorded in the worker processes
+            for _, worker_metrics in results:
+                metrics.merge(worker_metrics)
+            results = [result for result, _ in results]
+    (forecast_rows, forecast_failed), (precip_rows, precip_failed) = results
+
     # 6. enqueue tomorrow
 
     logger.info(
         f'Done reducing data. Pushed {forecast_rows} forecast rows and {precip_rows} precip rows.'
     )
+    metrics.log(
+        today=str(today), forecast_rows=forecast_rows, precip_rows=precip_rows,
+        forecast_failed=forecast_failed, precip_failed=precip_failed,
+    )
+
+    # reservoirs with failed rows are resumed from their first failed date on the next run
+    failed_msg = ''.join(
+        f"\n{len(failed)} {source} reservoirs failed to push: {', '.join(failed[:20])}"
+        for source, failed in [('forecast', forecast_failed), ('precip', precip_failed)]
+        if failed
+    )
 
     if slackmessenger is not None:
         slackmessenger.message(
-            f"REDUCE ::: {today} pushed {forecast_rows} forecast rows and {precip_rows} precip rows"
+            f"REDUCE ::: {today} pushed {forecast_rows} forecast rows and {precip_rows} precip rows\n"
+            f"{metrics.summary()}{failed_msg}"
         )
 
     if requeue:
@@ -207,6 +240,119 @@ def main_loop(
     return "Reduction complete", 200
 
 
+def run_source(
+    source: str,
+    table_str: str,
+    end_dt: datetime,
+    target_spec: dict,
+    gdf,
+    client: Optional[BQClient] = None,
+    warehouse_spec: Optional[dict] = None,
+) -> Tuple[int, List[str]]:
+    """Reduce and push all stale reservoirs of one source, opening its archive once.
+
+    Stale reservoirs are grouped into as few time windows as possible (see `plan_time_windows`),
+    each window is reduced from its earliest start date, and rows from before each reservoir's
+    own start date are dropped before pushing. Once rows of a reservoir fail to push, its later
+    rows (e.g. of later stream blocks) are not pushed.
+
+    Returns:
+        Tuple[int, List[str]]: the rows pushed, and the reservoirs that failed to push
+    """
+
+    if client is None:
+        client = get_warehouse(warehouse_spec)
+
+    with stage('most_recent_dates'):
+        max_date_df = client.get_most_recent_dates(table_str)
+
+    windows = plan_time_windows(
+        max_date_df, end_dt, max_extra_days=target_spec.get('max_extra_days', 31)
+    )
+    if len(windows) == 0:
+        return 0, []
+
+    with stage('open_archive'):
+        zx_arr, mapper = open_archive(target_spec)
+
+    stream_spec = target_spec.get('stream')
+    if stream_spec is True:
+        stream_spec = {}
+
+    # daily updates of only a few new days: reduce every stale reservoir in one eager pass
+    incremental_spec = target_spec.get('incremental')
+    if incremental_spec is True:
+        incremental_spec = {}
+    incremental = False
+    if incremental_spec is not None:
+        first_dt = min(start_dt for start_dt, _ in windows)
+        if end_dt - first_dt <= timedelta(days=incremental_spec.get('max_days', 7)):
+            windows = [(first_dt, [site for _, sites in windows for site in sites])]
+            incremental = True
+        else:
+            logger.info(f'{source} is behind since {first_dt}, not reducing incrementally')
+
+    tic = time.time()
+    rows = 0
+    push_stats = []
+    failed_reservoirs = set()
+    with dask_scheduler(get_dask_spec(target_spec)) as dask_settings:
+        compute_kwargs = dask_settings.pop('compute_kwargs')
+        for start_dt, sites in windows:
+            logger.info(f'Doing {source} {start_dt}-{end_dt} with {len(sites)} sites')
+            start_dates = max_date_df.set_index('reservoir').loc[sites, 'date'].to_dict()
+
+            if incremental:
+                dfs = [reduce_timeperiod_to_df(start_dt, end_dt, target_spec, gdf.loc[sites,:], zx_arr=zx_arr, incremental=True, compute_kwargs=compute_kwargs)]
+            elif stream_spec is not None:
+                # push each time block before reducing the next, so memory stays bounded
+                # and a crash resumes from the last pushed block on the next run
+                dfs = reduce_timeperiod_to_blocks(
+                    start_dt, end_dt, target_spec, gdf.loc[sites,:], zx_arr=zx_arr,
+                    block_days=stream_spec.get('block_days'), compute_kwargs=compute_kwargs,
+                )
+            else:
+                dfs = [reduce_timeperiod_to_df(start_dt, end_dt, target_spec, gdf.loc[sites,:], zx_arr=zx_arr, compute_kwargs=compute_kwargs)]
+
+            for df in dfs:
+                df = filter_new_rows(df, start_dates)
+                df = df.loc[~df['reservoir'].astype(str).isin(failed_reservoirs)]
+
+                # upload reduction
+                with stage('push') as record:
+                    batch_stats = client.push_data(table_str=table_str, df=df)
+                    record['bytes_sent'] = sum(el['bytes'] for el in batch_stats)
+                push_stats += batch_stats
+                rows += len(df) - sum(el['failed'] + el['unsent'] for el in batch_stats)
+                failed_reservoirs.update(name for el in batch_stats for name in el['failed_reservoirs'])
+
+    logger.info(f'{source} reduced {rows} rows in {time.time() - tic:.1f}s with dask settings {dask_settings}')
+    read_stats = mapper_stats(mapper)
+    get_metrics().add('read', {'bytes_read': read_stats.get('bytes_read', 0)})
+    logger.info(f"Read from {target_spec['url']}: {read_stats}")
+    logger.info(
+        f"Pushed {source} in {len(push_stats)} batches: "
+        f"{sum(el['bytes'] for el in push_stats)} bytes, "
+        f"{sum(el['retries'] for el in push_stats)} retries, "
+        f"{sum(el['failed'] for el in push_stats)} failed rows, "
+        f"{sum(el['unsent'] for el in push_stats)} unsent rows"
+    )
+    if failed_reservoirs:
+        logger.error(f"{source} reservoirs failed to push: {sorted(failed_reservoirs)}")
+
+    return rows, sorted(failed_reservoirs)
+
+
+def run_source_with_metrics(*args, **kwargs) -> Tuple[Tuple[int, List[str]], dict]:
+    """run_source in a worker process, also returning the metrics it recorded there."""
+
+    metrics = get_metrics()
+    metrics.reset()
+    result = run_source(*args, **kwargs)
+
+    return result, metrics.to_dict()
+
+
 def enqueue_tomorrow(today):
 
     tomorrow = today + timedelta(hours=24)
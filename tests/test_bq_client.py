@@ -0,0 +1,209 @@
+import datetime
+import threading
+
+import pandas as pd
+import pytest
+from google.api_core import exceptions
+from google.cloud import bigquery
+
+from h2ox.reducer import bq_client
+from h2ox.reducer.bq_client import BQClient
+
+SCHEMA = [
+    bigquery.SchemaField("reservoir", "STRING"),
+    bigquery.SchemaField("date", "DATE"),
+    bigquery.SchemaField("value", "FLOAT"),
+    bigquery.SchemaField("timestamp", "TIMESTAMP"),
+]
+
+
+class StubJob:
+    errors = None
+
+    def result(self):
+        return self
+
+
+class StubTable:
+    schema = SCHEMA
+
+
+class StubClient:
+    """A stand-in for bigquery.Client, keeping inserted rows and loaded frames in memory.
+
+    Args:
+        insert (callable): optional (rows) -> errors, as insert_rows_json, or raises
+    """
+
+    def __init__(self, insert=None):
+        self.insert = insert
+        self.requests = []
+        self.rows = []
+        self.loads = []
+        self._lock = threading.Lock()
+
+    def insert_rows_json(self, table, rows):
+        with self._lock:
+            self.requests.append(list(rows))
+        errors = self.insert(rows) if self.insert is not None else []
+        if not errors:
+            with self._lock:
+                self.rows += rows
+        return errors
+
+    def get_table(self, table):
+        return StubTable()
+
+    def load_table_from_file(self, buffer, table, job_config=None):
+        self.loads.append(pd.read_parquet(buffer))
+        return StubJob()
+
+
+@pytest.fixture(autouse=True)
+def no_env(monkeypatch):
+    for name in ["WATERMARK_PATH", "WATERMARK_TABLE", "BQ_PUSH_METHOD", "BQ_TABLES"]:
+        monkeypatch.delenv(name, raising=False)
+    # don't wait between retries
+    monkeypatch.setattr(bq_client.time, "sleep", lambda seconds: None)
+
+
+def _df(n_reservoirs=3, n_days=5):
+    dates = pd.date_range("2020-01-01", periods=n_days).strftime("%Y-%m-%d")
+    df = pd.DataFrame(
+        [
+            {
+                "reservoir": f"r{ii}",
+                "date": date,
+                "value": float(jj),
+                "timestamp": "2020-02-01T00:00:00",
+            }
+            for jj, date in enumerate(dates)
+            for ii in range(n_reservoirs)
+        ]
+    )
+    # pushes may come in any order
+    return df.sample(frac=1, random_state=0).reset_index(drop=True)
+
+
+def test_coerce_to_schema():
+
+    df = BQClient.coerce_to_schema(_df(1, 2), SCHEMA)
+
+    assert all(isinstance(date, datetime.date) for date in df["date"])
+    assert str(df["timestamp"].dtype) == "datetime64[ns, UTC]"
+    assert df["reservoir"].dtype == object
+
+
+def test_load_chunks_in_date_order():
+
+    client = StubClient()
+    bq = BQClient(client=client, push_method="load", load_chunk_rows=4)
+    df = _df(3, 5)
+
+    stats = bq.push_data("precip_data", df)
+
+    assert [el["rows"] for el in stats] == [4, 4, 4, 3]
+    assert [len(load) for load in client.loads] == [4, 4, 4, 3]
+    loaded = pd.concat(client.loads, ignore_index=True)
+    assert len(loaded) == len(df)
+    # earliest dates first, coerced to the DATE schema
+    assert list(loaded["date"]) == sorted(loaded["date"])
+    assert isinstance(loaded["date"][0], datetime.date)
+    assert all(el["bytes"] > 0 and el["failed"] == 0 for el in stats)
+
+
+def test_stream_batches_and_retries_transient_errors():
+
+    calls = []
+
+    def insert(rows):
+        calls.append(len(rows))
+        if len(calls) == 1:
+            return [{"index": 0, "errors": [{"reason": "backendError"}]}] + [
+                {"index": ii, "errors": [{"reason": "stopped"}]}
+                for ii in range(1, len(rows))
+            ]
+        return []
+
+    client = StubClient(insert)
+    bq = BQClient(client=client, push_method="stream", batch_rows=4, stream_workers=1)
+    df = _df(2, 5)
+
+    stats = bq.push_data("precip_data", df)
+
+    assert len(client.rows) == len(df)
+    assert sum(el["retries"] for el in stats) == 1
+    assert sum(el["failed"] + el["unsent"] for el in stats) == 0
+    assert all(len(request) <= 4 for request in client.requests)
+
+
+def test_stream_splits_oversized_requests():
+
+    def insert(rows):
+        if len(rows) > 2:
+            raise exceptions.BadRequest("Request payload size exceeds the limit")
+        return []
+
+    client = StubClient(insert)
+    bq = BQClient(client=client, push_method="stream", batch_rows=8, stream_workers=2)
+    df = _df(3, 4)
+
+    stats = bq.push_data("precip_data", df)
+
+    assert len(client.rows) == len(df)
+    assert sum(el["failed"] + el["unsent"] for el in stats) == 0
+    assert max(len(request) for request in client.requests) > 2
+    assert len(client.requests) > len(df) // 2
+
+
+@pytest.mark.parametrize("stream_workers", [1, 4])
+def test_stream_failed_reservoir_sends_no_later_rows(stream_workers):
+
+    def insert(rows):
+        bad = [
+            ii
+            for ii, row in enumerate(rows)
+            if row["reservoir"] == "r1" and row["date"] == "2020-01-02"
+        ]
+        if not bad:
+            return []
+        return [
+            {"index": ii, "errors": [{"reason": "invalid" if ii in bad else "stopped"}]}
+            for ii in range(len(rows))
+        ]
+
+    client = StubClient(insert)
+    bq = BQClient(
+        client=client, push_method="stream", batch_rows=2, stream_workers=stream_workers
+    )
+    df = _df(4, 6)
+
+    stats = bq.push_data("precip_data", df)
+
+    landed = pd.DataFrame(client.rows)
+    r1_dates = landed.loc[landed["reservoir"] == "r1", "date"]
+    # r1 lands up to its failed date, and no later, the other reservoirs land completely
+    assert (r1_dates < "2020-01-02").all()
+    assert (landed["reservoir"] != "r1").sum() == 3 * 6
+    assert sorted({name for el in stats for name in el["failed_reservoirs"]}) == ["r1"]
+    assert sum(el["failed"] for el in stats) == 1
+    assert sum(el["failed"] + el["unsent"] for el in stats) == len(df) - len(landed)
+
+
+def test_stream_request_errors_fail_only_their_reservoirs():
+
+    def insert(rows):
+        if any(row["reservoir"] == "r0" for row in rows):
+            raise exceptions.ServiceUnavailable("unavailable")
+        return []
+
+    client = StubClient(insert)
+    bq = BQClient(client=client, push_method="stream", batch_rows=3, stream_workers=3)
+    df = _df(3, 4)
+
+    stats = bq.push_data("precip_data", df)
+
+    landed = pd.DataFrame(client.rows)
+    assert set(landed["reservoir"]) == {"r1", "r2"}
+    assert len(landed) == 2 * 4
+    assert sorted({name for el in stats for name in el["failed_reservoirs"]}) == ["r0"]
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from shapely import geometry
+
+from h2ox.reducer.geoutils import get_mask
+
+LONS = np.round(np.arange(60, 70, 0.25), 6)
+LATS = np.round(np.arange(10, 20, 0.25), 6)
+
+POLYGON = geometry.Polygon(
+    [(61.1, 11.3), (66.7, 11.9), (68.2, 16.4), (64.3, 18.8), (61.6, 15.2)]
+)
+HOLE = geometry.Polygon(
+    POLYGON.exterior.coords,
+    holes=[[(63.2, 13.1), (65.4, 13.4), (65.9, 15.7), (63.6, 15.3)]],
+)
+MULTIPOLYGON = geometry.MultiPolygon(
+    [
+        geometry.box(60.6, 10.7, 62.9, 12.2),
+        geometry.Polygon([(64.1, 14.3), (68.8, 15.1), (67.2, 19.1), (65.1, 18.2)]),
+    ]
+)
+
+
+@pytest.mark.parametrize(
+    "lons, lats, geom",
+    [
+        (LONS, LATS, POLYGON),
+        (LONS, LATS, HOLE),
+        (LONS, LATS, MULTIPOLYGON),
+        (LONS, LATS[::-1], HOLE),
+        (LONS, LATS[::-1], MULTIPOLYGON),
+        # pacific-centric 0-360deg grid, with a geometry in -180-180deg
+        (np.round(np.arange(180, 200, 0.25), 6), LATS, geometry.box(-178.9, 11.1, -172.3, 17.6)),
+    ],
+    ids=["polygon", "hole", "multipolygon", "descending-hole", "descending-multipolygon", "0-360"],
+)
+def test_vectorized_mask_matches_area_engine(lons, lats, geom):
+
+    mask, bounds, extents = get_mask(lons, lats, geom, engine="vectorized")
+    area_mask, area_bounds, area_extents = get_mask(lons, lats, geom, engine="area")
+
+    assert bounds == area_bounds
+    assert np.allclose(extents, area_extents)
+    assert mask.shape == area_mask.shape
+    assert np.abs(mask - area_mask).max() < 1e-9
+    assert mask.sum() > 0
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from h2ox.reducer.mappers import mapper_stats
+from h2ox.reducer.reducer import get_mapper
+
+
+def _dataset(values, start):
+    return xr.Dataset(
+        {"precip": (("time", "latitude", "longitude"), values.astype(np.float32))},
+        coords={
+            "time": pd.date_range(start, periods=values.shape[0], freq="1D"),
+            "latitude": [10.0, 10.5],
+            "longitude": [60.0, 60.5, 61.0],
+        },
+    )
+
+
+def test_caching_mapper_serves_appended_steps(tmp_path):
+
+    path = tmp_path / "archive.zarr"
+    # time chunks of 10, so the append below lands in the existing trailing chunk
+    _dataset(np.ones((3, 2, 3)), "2020-01-01").to_zarr(
+        path,
+        mode="w",
+        consolidated=True,
+        encoding={"precip": {"chunks": (10, 2, 3)}, "time": {"chunks": (10,)}},
+    )
+    target_spec = {
+        "url": "file://" + str(path),
+        "chunk_cache": {"dir": str(tmp_path / "cache"), "metadata_ttl": 0},
+    }
+
+    # a cold read fills the cache, re-opening serves the chunks from it
+    mapper = get_mapper(target_spec)
+    assert xr.open_zarr(mapper)["precip"].values.sum() == 18
+    assert mapper_stats(mapper)["cache_misses"] > 0
+
+    mapper = get_mapper(target_spec)
+    assert xr.open_zarr(mapper)["precip"].values.sum() == 18
+    hits = mapper_stats(mapper)["cache_hits"]
+    assert hits > 0
+
+    # appending into the cached trailing time chunk changes the array's metadata,
+    # so its cached chunks are not served again
+    _dataset(np.full((1, 2, 3), 2.0), "2020-01-04").to_zarr(
+        path, append_dim="time", consolidated=True
+    )
+
+    mapper = get_mapper(target_spec)
+    precip = xr.open_zarr(mapper)["precip"].values
+    assert precip.shape == (4, 2, 3)
+    assert not np.isnan(precip).any()
+    np.testing.assert_array_equal(precip[-1], 2.0)
+    np.testing.assert_array_equal(precip[:3], 1.0)
@@ -0,0 +1,117 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from scipy import sparse
+from shapely import geometry
+
+from h2ox.reducer import xr_reducer
+from h2ox.reducer.mask_cache import MaskCache
+from h2ox.reducer.xr_reducer import _day_chunks, get_cached_mask, reduce_variable
+
+LATS = np.arange(10, 12, 0.5)
+LONS = np.arange(60, 62.5, 0.5)
+
+
+def _weights(n_geoms=3, seed=0):
+    rng = np.random.default_rng(seed)
+    weights = rng.random((n_geoms, LATS.shape[0] * LONS.shape[0]))
+    weights[weights < 0.4] = 0
+    return sparse.csr_matrix(weights)
+
+
+def _array(with_step=False, seed=0):
+    """6-hourly float64 values over four days, with the third day missing, and some NaNs."""
+
+    times = pd.date_range("2020-01-01", periods=16, freq="6h")
+    times = times[(times < "2020-01-03") | (times >= "2020-01-04")]
+
+    dims = ["time", "latitude", "longitude"]
+    coords = {"time": times, "latitude": LATS, "longitude": LONS}
+    if with_step:
+        coords["step"] = pd.to_timedelta(np.arange(10) * 6, unit="h")
+        dims = ["time", "step", "latitude", "longitude"]
+
+    rng = np.random.default_rng(seed)
+    shape = tuple(len(coords[dim]) for dim in dims)
+    values = rng.gamma(0.5, 2.0, size=shape) - 0.2
+    values[rng.random(shape) < 0.02] = np.nan
+
+    return xr.DataArray(values, dims=dims, coords=coords, name="precip")
+
+
+def _resampled(array, weights, names):
+    reduced = reduce_variable(array, weights, names, "reservoir")
+    reduced = reduced.resample({"time": "1D"}).mean("time")
+    if "step" in reduced.dims:
+        reduced = reduced.resample({"step": timedelta(days=1)}).mean("step")
+    return reduced
+
+
+@pytest.mark.parametrize("with_step", [False, True], ids=["time", "time-step"])
+@pytest.mark.parametrize("time_chunk", [None, 3, 5, 16], ids=["numpy", "3", "5", "16"])
+def test_fused_daily_matches_resample(with_step, time_chunk):
+
+    array = _array(with_step=with_step)
+    if time_chunk is not None:
+        # time chunks not on day edges, which the fused path has to move onto them
+        array = array.chunk({"time": time_chunk, "latitude": 2, "longitude": 3})
+    weights = _weights()
+    names = ["a", "b", "c"]
+
+    fused = reduce_variable(array, weights, names, "reservoir", daily=True).compute()
+    expected = _resampled(array, weights, names).compute()
+
+    assert fused.dims == expected.dims
+    np.testing.assert_array_equal(fused["time"].values, expected["time"].values)
+    if with_step:
+        np.testing.assert_array_equal(fused["step"].values, expected["step"].values)
+    # the missing day is NaN in both
+    np.testing.assert_allclose(fused.values, expected.values, rtol=1e-12, equal_nan=True)
+    assert np.isnan(fused.sel(time="2020-01-03").values).all()
+
+
+def test_day_chunks_align_to_day_edges():
+
+    # four 6-hourly steps per day, over three days
+    days = np.repeat(np.arange(3), 4)
+
+    time_chunks, day_chunks = _day_chunks(days, (3, 3, 3, 3))
+
+    assert sum(time_chunks) == days.shape[0]
+    assert sum(day_chunks) == 3
+    edges = np.cumsum(time_chunks)[:-1]
+    assert all(days[edge] != days[edge - 1] for edge in edges)
+
+
+def test_cached_mask_skips_simplification_on_hit(tmp_path, monkeypatch):
+
+    mask_cache = MaskCache(str(tmp_path))
+    geom = geometry.Polygon([(60.2, 10.1), (61.6, 10.3), (61.4, 11.2), (60.4, 11.1)])
+    tolerance = 0.1
+
+    mask, bounds, extents, error = get_cached_mask(
+        LONS, LATS, geom, mask_cache=mask_cache, tolerance=tolerance
+    )
+    assert mask_cache.misses == 1
+    assert error is not None
+
+    def no_simplify(geom, tolerance):
+        raise AssertionError("simplified on a cache hit")
+
+    monkeypatch.setattr(xr_reducer, "simplify_geometry", no_simplify)
+
+    # keyed on the original geometry and tolerance, with the error kept alongside the mask
+    cached_mask, cached_bounds, cached_extents, cached_error = get_cached_mask(
+        LONS, LATS, geom, mask_cache=mask_cache, tolerance=tolerance
+    )
+    assert mask_cache.hits == 1
+    assert cached_error == error
+    assert cached_bounds == bounds
+    np.testing.assert_array_equal(cached_mask, mask)
+
+    # unsimplified masks of the same geometry are cached separately
+    assert get_cached_mask(LONS, LATS, geom, mask_cache=mask_cache)[3] is None
+    assert mask_cache.misses == 2